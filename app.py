@@ -1,73 +1,92 @@
 import os
-import time
-import datetime, pytz
 import flask
 import dash
 from dash import Dash, html, dcc
 import dash_bootstrap_components as dbc
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+try:
+    # optional, gzip/brotli responses when installed
+    import flask_compress
+except ImportError:
+    flask_compress = None
 
-from etl.get_races import update_scheduled_races
+from utils.database import Database
+from utils.instrument import instrumentation
 
-server = flask.Flask(__name__)
 
-app = Dash(__name__,
-           server=server,
-           use_pages=True, 
-           external_stylesheets=[dbc.themes.BOOTSTRAP])
+def build_navbar():
+    return dbc.NavbarSimple(
+        children=[
+            dbc.NavItem(dbc.NavLink(page['name'], href=page["relative_path"]))
+            for page in dash.page_registry.values()
+        ],
+        brand="Big Haus Racing",
+        color="primary",
+        dark=True,
+        brand_href="/"
+    )
 
-navbar = dbc.NavbarSimple(
-    children=[
-        dbc.NavItem(dbc.NavLink(page['name'], href=page["relative_path"]))
-        for page in dash.page_registry.values()
-    ],
-    brand="Big Haus Racing",
-    color="primary",
-    dark=True,
-    brand_href="/"
-)
-
-app.layout = html.Div([
-    navbar,
-    dash.page_container
-])
-
-def check_if_not_debug_thread():
+def check_if_not_debug_thread(debug):
     """dash/flask runs on two threads for debug b/c of hot reload
     so this checks if it's not debug or if it's the main thread.
     """
-    return not app.server.debug or os.environ.get('WERKZEUG_RUN_MAIN')=='true'
+    return not debug or os.environ.get('WERKZEUG_RUN_MAIN')=='true'
 
-def my_cron_job():
-    # debug will run the scheduler twice, so you need to check if it's debug mode so it doesn't run the functions twice
-    if check_if_not_debug_thread(): 
-        now = datetime.datetime.utcnow().astimezone(pytz.timezone("EST"))
-        print(f"running {now}")
-        # Code to be executed by the cron job
-        with open("test-job.txt", "a") as f:
-            # just write the current date to a file so we know it's working
-            f.write(f"{now}\n")
-     
+def start_scheduler():
+    """run the ETL flows in this process, polling the schedule faster as post times approach.
+    Every job takes a postgres advisory lock so extra app processes don't double run it"""
+    # prefect/apscheduler are only needed where the jobs run, not in web workers
+    from etl.get_races import update_scheduled_races, race_schedule_cadence
+    from utils.scheduler import JobRunner
+    from utils.snapshots import maintain_snapshots
     
-if __name__ == '__main__':    
+    runner = JobRunner()
+    runner.add_dynamic_job(update_scheduled_races, 
+                           cadence=lambda: race_schedule_cadence(runner.db),
+                           name="update_scheduled_races",
+                           jitter=5)
+    # keeps tvg.race_snapshots bounded at minute level polling
+    runner.add_job(maintain_snapshots, 'interval', hours=1, jitter=60, args=(runner.db,))
+    runner.start()
+    return runner
+
+
+def create_app(scheduler=None):
+    """build the Dash app, wsgi.py serves create_app().server with gunicorn.
+    scheduler: also run the JobRunner in this process, defaults to $RUN_SCHEDULER. Web workers
+    leave it off and the jobs run in their own process (worker.py)"""
+    if scheduler is None:
+        scheduler = os.getenv("RUN_SCHEDULER", "0").lower() in ("1", "true", "yes")
+    server = flask.Flask(__name__)
     
-    scheduler = BackgroundScheduler() 
+    app = Dash(__name__,
+               server=server,
+               use_pages=True, 
+               # page layouts are functions that load data, skip dash calling them all to build a validation layout
+               suppress_callback_exceptions=True,
+               compress=flask_compress is not None,
+               external_stylesheets=[dbc.themes.BOOTSTRAP])
     
-    # https://apscheduler.readthedocs.io/en/3.x/modules/triggers/cron.html
-    # Schedule the cron job to run every minute a the 15 seconds
-    scheduler.add_job(func=my_cron_job, 
-                        trigger=CronTrigger(second="0,15,30,45"),
-                        max_instances=1)
+    app.layout = html.Div([
+        build_navbar(),
+        dash.page_container
+    ])
     
-    # Schedule the cron job to run at 9, 12 , 15, 18 at eastern timezon
-    # scheduler.add_job(func=my_cron_job, 
-    #                     trigger=CronTrigger(hour="9,12,15,18", timezone=pytz.timezone("EST")),
-    #                     max_instances=1)
+    runner = start_scheduler() if scheduler else None
     
-    # Start the scheduler
-    scheduler.start() 
-        
-    app.run(debug=True)
+    @server.route("/jobs")
+    def job_metrics():
+        return flask.jsonify(runner.metrics() if runner else {})
+
+    @server.route("/db/stats")
+    def db_stats():
+        """per query fingerprint calls/rows/p50/p95/p99 for this process plus connection pool counters"""
+        return flask.jsonify({'queries': instrumentation.stats(), 'pool': Database().pool_stats()})
     
+    return app
+
 
+if __name__ == '__main__':    
+    
+    # debug will run the app twice, so only start the scheduler in the reloader's child
+    app = create_app(scheduler=check_if_not_debug_thread(debug=True))
+    app.run(debug=True)
@@ -0,0 +1,58 @@
+"""aggregate latency of N independent reads: sequential Database vs asyncio.gather on AsyncDatabase
+
+run from the repo root against a local postgres with tvg.races loaded:
+    python -m benchmarks.bench_async_reads -n 50
+"""
+import argparse
+import asyncio
+import time
+
+from utils.database import Database, AsyncDatabase
+
+# pg_sleep stands in for a realistic per-query server time so the overlap is visible on a tiny table
+SQL = """SELECT race_id, track_id, post_time, pg_sleep(%(sleep)s)::text AS _ 
+         FROM tvg.races WHERE track_id = %(track)s"""
+
+
+def tracks(db, n):
+    found = [r['track_id'] for r in db.query("SELECT DISTINCT track_id FROM tvg.races", as_df=False)] or ["USA_BEL"]
+    return [found[i % len(found)] for i in range(n)]
+
+
+def run_sync(db, tracks, sleep):
+    start = time.perf_counter()
+    for t in tracks:
+        db.query(SQL, {'track': t, 'sleep': sleep})
+    return time.perf_counter() - start
+
+
+async def run_async(db, tracks, sleep):
+    # warm the pool so we time queries, not connection setup
+    await db.execute("SELECT 1")
+    start = time.perf_counter()
+    await asyncio.gather(*[db.query(SQL, {'track': t, 'sleep': sleep}) for t in tracks])
+    elapsed = time.perf_counter() - start
+    await AsyncDatabase.close_pools()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=50, help="number of reads")
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--sleep", type=float, default=0.01, help="server side seconds per query")
+    args = parser.parse_args()
+
+    db = Database(max_size=args.pool_size)
+    ts = tracks(db, args.n)
+    db.execute("SELECT 1")
+    sync = run_sync(db, ts, args.sleep)
+    adb = AsyncDatabase(max_size=args.pool_size)
+    async_ = asyncio.run(run_async(adb, ts, args.sleep))
+    print(f"{args.n} reads, pool max_size={args.pool_size}")
+    print(f"  Database sequential      {sync:7.3f}s")
+    print(f"  AsyncDatabase gather     {async_:7.3f}s  {sync / async_:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""reader latency while a large upsert_df_except_null load runs on another connection
+
+readers loop a point lookup and a small range scan on the table being loaded, the writer runs one
+upsert_df_except_null of --rows rows. With the old per chunk LOCK TABLE readers stalled for the whole
+load, now their latency during the load should stay close to the idle baseline.
+
+run from the repo root against a scratch database (.env DB_* params):
+    python -m benchmarks.bench_concurrent_upsert --rows 200000 --readers 4
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from utils.database import Database
+from benchmarks.bench_upsert import TABLE, make_df, reset_table
+
+READ_SQL = [f"SELECT * FROM {TABLE} WHERE race_id = %(race_id)s",
+            f"SELECT count(*) FROM {TABLE} WHERE race_number = %(race_number)s"]
+
+
+def reader(db, stop, latencies):
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        db.query(READ_SQL[i % 2], {'race_id': f"USA_BEL_2024-01-01_{i}", 'race_number': i % 12 + 1}, as_df=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+        i += 1
+
+
+def read_during(db, n_readers, seconds=None, work=None):
+    """run readers for `seconds` or for as long as work() takes, returns (reader latencies ms, work seconds)"""
+    stop, latencies = threading.Event(), []
+    threads = [threading.Thread(target=reader, args=(db, stop, latencies), daemon=True) for _ in range(n_readers)]
+    for t in threads:
+        t.start()
+    start = time.perf_counter()
+    if work:
+        work()
+    else:
+        time.sleep(seconds)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in threads:
+        t.join()
+    return latencies, elapsed
+
+
+def summary(latencies):
+    q = statistics.quantiles(latencies, n=100)
+    return f"{len(latencies):>8} reads  p50 {q[49]:8.2f}ms  p99 {q[98]:8.2f}ms  max {max(latencies):9.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--method", default="executemany", choices=["executemany", "copy"])
+    parser.add_argument("--per-chunk", action="store_true", help="commit each chunk instead of one transaction")
+    args = parser.parse_args()
+
+    db = Database(max_size=args.readers + 2)
+    df = make_df(args.rows)
+    reset_table(db)
+    # seed the table so the load is all ON CONFLICT updates on rows the readers can see
+    db.upsert_df(df, TABLE, pkeys=['race_id'], method="copy")
+
+    idle, _ = read_during(db, args.readers, seconds=2)
+    load = lambda: db.upsert_df_except_null(df, TABLE, pkeys=['race_id'], method=args.method,
+                                            atomic=not args.per_chunk)
+    busy, elapsed = read_during(db, args.readers, work=load)
+    print(f"{args.rows} row upsert_df_except_null [{args.method}] took {elapsed:.2f}s, {args.readers} readers")
+    print(f"  idle    {summary(idle)}")
+    print(f"  loading {summary(busy)}")
+    db.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+if __name__ == "__main__":
+    main()
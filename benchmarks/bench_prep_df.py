@@ -0,0 +1,88 @@
+"""time the column-wise _prep_frame against the old per-value cleaning
+
+no database needed:
+    python -m benchmarks.bench_prep_df --rows 1000000
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.database import Database, COMMA_PAT
+
+DTYPES = {'horse_id': 'integer', 'purse': 'numeric', 'horse_name': 'text',
+          'foaling_date': 'date', 'earnings': 'bigint', 'meta': 'jsonb'}
+
+
+def make_df(n, seed=0):
+    rng = np.random.default_rng(seed)
+    names = np.array(["Secretariat", "Seattle Slew;", "War\\.Admiral", " Citation\n", None], dtype=object)
+    return pd.DataFrame({
+        'horse_id': rng.integers(1, 10**6, n).astype(float),
+        'purse': [f"{x:,}" for x in rng.integers(1_000, 2_000_000, n)],
+        'horse_name': rng.choice(names, n),
+        'foaling_date': pd.Timestamp("2019-01-01") + pd.to_timedelta(rng.integers(0, 1500, n), unit="D"),
+        'earnings': rng.integers(0, 10**7, n),
+        'meta': [{'k': int(x)} if x % 3 else None for x in rng.integers(0, 100, n)],
+    })
+
+
+def legacy_prep_val(val, dtype):
+    """the per-scalar cleaning _prep_frame replaced"""
+    if val is None or (isinstance(val, float) and np.isnan(val)) or val == "":
+        return None
+    if dtype in Database.FLOAT_DTYPES:
+        return COMMA_PAT.sub("", val) if isinstance(val, str) else val
+    if dtype in Database.INT_DTYPES:
+        if isinstance(val, str):
+            val = COMMA_PAT.sub("", val)
+        v = round(float(val), 0)
+        assert v - round(float(val), 4) == 0
+        return int(v)
+    if dtype in Database.TEXT_DTYPES:
+        return (str(val).replace("\n", "  ").replace("\t", "  ").replace("\r", "  ").replace(";", "  ")
+                .replace("\\.", ".").replace("\\", "  ").strip())
+    if dtype == "date":
+        return str(val)[:10]
+    if dtype in Database.JSON_DTYPES:
+        return json.dumps(val, default=str)
+    return val
+
+
+def legacy_prep(df, dtypes):
+    df = df.astype(object)
+    df = df.where(pd.notnull(df), None)
+    for c in df:
+        df[c] = [legacy_prep_val(v, dtypes[c]) for v in df[c]]
+    return df.values
+
+
+def timeit(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_df(args.rows)
+    prep = timeit(lambda: Database._prep_frame(df, DTYPES), args.repeat)
+    prep_rows = timeit(lambda: Database._df_rows(Database._prep_frame(df, DTYPES)), args.repeat)
+    legacy = timeit(lambda: legacy_prep(df, DTYPES), args.repeat)
+    print(f"rows={args.rows:,}")
+    print(f"  per-value (legacy)          {legacy:8.2f}s")
+    print(f"  _prep_frame                 {prep:8.2f}s  {legacy / prep:5.1f}x")
+    print(f"  _prep_frame + _df_rows      {prep_rows:8.2f}s  {legacy / prep_rows:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""app startup cost: `python -X importtime` breakdown of importing wsgi and wall clock from process
+start to the first served /races request (flask test client, no db work since layouts load on the page callback)
+
+run from the repo root:
+    python -m benchmarks.bench_startup --repeat 5 --compare benchmarks/results/startup_<previous>.json
+
+results are written to benchmarks/results/startup_<time>_<rev>.json so boot regressions show up between commits
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.run import ROOT, RESULTS, git_rev
+
+# child process: import the app, serve one request, report when each step finished
+FIRST_REQUEST = """
+import time, json
+from wsgi import server
+imported = time.time()
+r = server.test_client().get("/races")
+print(json.dumps({'imported': imported, 'served': time.time(), 'status': r.status_code}))
+"""
+
+
+def env():
+    # never start jobs or touch a real cache dir from the benchmark
+    return {**os.environ, 'RUN_SCHEDULER': "0", 'CACHE_DIR': os.path.join(RESULTS, ".startup-cache")}
+
+
+def import_times(module="wsgi"):
+    """{module: (self us, cumulative us)} from -X importtime, which reports on stderr"""
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, env=env(),
+                       capture_output=True, text=True, check=True)
+    times = {}
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = (x.strip() for x in line[len("import time:"):].split("|"))
+        times[name.strip()] = (int(self_us), int(cumulative))
+    return times
+
+
+def first_request():
+    start = time.time()
+    r = subprocess.run([sys.executable, "-c", FIRST_REQUEST], cwd=ROOT, env=env(),
+                       capture_output=True, text=True, check=True)
+    out = json.loads(r.stdout.strip().splitlines()[-1])
+    return {'import_s': out['imported'] - start, 'first_request_s': out['served'] - start, 'status': out['status']}
+
+
+def top_packages(times, n):
+    """top level packages by cumulative import time"""
+    roots = {name: cumulative for name, (_, cumulative) in times.items() if "." not in name}
+    return sorted(roots.items(), key=lambda x: -x[1])[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="packages to list in the importtime breakdown")
+    parser.add_argument("--out", help="results json path")
+    parser.add_argument("--compare", help="previous startup results json to compare against")
+    args = parser.parse_args()
+
+    runs = [first_request() for _ in range(args.repeat)]
+    times = import_times()
+    result = {'meta': {'git_rev': git_rev(), 'time': datetime.datetime.utcnow().isoformat(),
+                       'python': sys.version.split()[0], 'repeat': args.repeat},
+              'import_s': statistics.median(r['import_s'] for r in runs),
+              'first_request_s': statistics.median(r['first_request_s'] for r in runs),
+              'status': runs[-1]['status'],
+              'total_import_us': times.get("wsgi", (0, 0))[1],
+              'top_packages_us': dict(top_packages(times, args.top)),
+              'loaded': sorted(p for p in ("pandas", "numpy", "plotly", "plotly.express", "pyarrow", "prefect", "apscheduler")
+                               if p in times)}
+
+    print(f"import wsgi        {result['import_s']:7.3f}s (median of {args.repeat})")
+    print(f"first /races       {result['first_request_s']:7.3f}s  status {result['status']}")
+    print(f"heavy modules imported eagerly: {', '.join(result['loaded']) or 'none'}")
+    print("cumulative import time by package:")
+    for name, us in result['top_packages_us'].items():
+        print(f"  {name:<30} {us / 1000:8.1f}ms")
+
+    RESULTS.mkdir(exist_ok=True)
+    path = args.out or RESULTS / f"startup_{datetime.datetime.utcnow():%Y%m%dT%H%M%S}_{result['meta']['git_rev']}.json"
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nwrote {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"\nvs {args.compare} ({previous['meta']['git_rev']}), >1 is slower")
+        for k in ('import_s', 'first_request_s'):
+            ratio = result[k] / previous[k] if previous[k] else float("nan")
+            print(f"  {k:<20} {ratio:6.2f}x{'  <-- regression' if ratio > 1.2 else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""fetch a large schedule from the local stub in one request vs concurrent pages
+
+    python -m benchmarks.bench_tvg_fetch --races 1000 10000 50000 --page-size 500
+"""
+import argparse
+import time
+
+import requests
+
+from benchmarks.tvg_stub import serve, synthetic_races, load_fixture
+from etl.tvg import TVGClient, merge_pages
+
+
+def timed(fn):
+    start = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - start, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--races", nargs="+", type=int, default=[1_000, 10_000, 50_000])
+    parser.add_argument("--fixture", help="recorded response to serve instead of synthetic races")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub seconds per request")
+    args = parser.parse_args()
+
+    sizes = [None] if args.fixture else args.races
+    print(f"{'races':>8} {'one request s':>14} {'paged s':>10} {'requests.post s':>16}")
+    for n in sizes:
+        races = load_fixture(args.fixture) if args.fixture else synthetic_races(n)
+        server, url = serve(races, latency=args.latency)
+        client = TVGClient(url=url, max_workers=args.workers)
+        # the old code path: new connection per call, no gzip
+        cold, _ = timed(lambda: requests.post(url, json={'variables': {}}, headers={'accept-encoding': 'identity'}).json())
+        one, data = timed(client.race_schedule)
+        paged, pages = timed(lambda: merge_pages(client.race_schedule_pages(page_size=args.page_size)))
+        assert len(pages['data']['races']) == len(data['data']['races']) == len(races)
+        print(f"{len(races):>8} {one:>14.3f} {paged:>10.3f} {cold:>16.3f}")
+        client.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
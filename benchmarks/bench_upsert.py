@@ -0,0 +1,69 @@
+"""compare the COPY/staging upsert path against executemany
+
+run from the repo root against a scratch database (.env DB_* params):
+    python -m benchmarks.bench_upsert --sizes 1000 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.database import Database
+
+TABLE = "bench_upsert"
+
+
+def make_df(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'race_id': [f"USA_BEL_2024-01-01_{i}" for i in range(n)],
+        'track_id': rng.choice(["USA_BEL", "USA_SAR", "USA_AQU", "GBR_ASC"], n),
+        'race_date': pd.Timestamp("2024-01-01").date(),
+        'race_number': rng.integers(1, 13, n),
+        'distance': rng.choice(["6f", "1m", "1 1/16m"], n),
+        'surface': rng.choice(["dirt", "turf", None], n),
+    })
+
+
+def reset_table(db):
+    db.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    db.execute(f"""CREATE TABLE {TABLE}(
+        race_id TEXT PRIMARY KEY,
+        track_id TEXT NOT NULL,
+        race_date DATE NOT NULL,
+        race_number INT NOT NULL,
+        distance TEXT NOT NULL,
+        surface TEXT)""")
+
+
+def run(db, df, method, upsert):
+    reset_table(db)
+    # first load inserts, second load hits ON CONFLICT for every row
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        getattr(db, upsert)(df, TABLE, pkeys=['race_id'], method=method)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--upsert", default="upsert_df", 
+                        choices=["upsert_df", "upsert_df_except_null", "upsert_df_only_null"])
+    args = parser.parse_args()
+
+    db = Database()
+    print(f"{'rows':>10} {'method':>12} {'insert s':>10} {'update s':>10} {'rows/s':>12}")
+    for n in args.sizes:
+        df = make_df(n)
+        for method in ("executemany", "copy"):
+            ins, upd = run(db, df, method, args.upsert)
+            print(f"{n:>10} {method:>12} {ins:>10.2f} {upd:>10.2f} {2 * n / (ins + upd):>12,.0f}")
+    db.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""load test for the /races and /stable pages: the page shell plus the table callbacks each page fires
+
+against the dev server (python app.py) and then gunicorn (gunicorn -c gunicorn.conf.py), same db:
+    locust -f benchmarks/locustfile.py --headless -u 50 -r 10 -t 60s --host http://127.0.0.1:8050
+
+compare the requests/s and percentile columns of the two runs
+"""
+import random
+
+from locust import HttpUser, task, between
+
+TRACKS = ["USA_BEL", "USA_SAR", "USA_AQU", "USA_SA", "GBR_ASC"]
+SORTS = [[], [{'column_id': 'post_time', 'direction': 'asc'}], [{'column_id': 'race_date', 'direction': 'desc'}]]
+
+
+def table_callback(table_id, page_current, sort_by, extra_inputs=()):
+    """_dash-update-component body for a paged table's data/page_count callback"""
+    inputs = [{'id': table_id, 'property': 'page_current', 'value': page_current},
+              {'id': table_id, 'property': 'page_size', 'value': 50},
+              {'id': table_id, 'property': 'sort_by', 'value': sort_by},
+              {'id': table_id, 'property': 'filter_query', 'value': ''},
+              *extra_inputs]
+    return {'output': f"..{table_id}.data...{table_id}.page_count..",
+            'outputs': [{'id': table_id, 'property': 'data'}, {'id': table_id, 'property': 'page_count'}],
+            'inputs': inputs,
+            'changedPropIds': [f"{table_id}.page_current"],
+            'state': []}
+
+
+class DashboardUser(HttpUser):
+    wait_time = between(0.5, 2)
+
+    @task(2)
+    def races_page(self):
+        self.client.get("/races")
+        self.client.get("/_dash-layout")
+
+    @task(5)
+    def races_table(self):
+        tracks = random.sample(TRACKS, k=random.randint(0, 2)) or None
+        body = table_callback("races-races", random.randint(0, 5), random.choice(SORTS),
+                              [{'id': 'races-track-filter', 'property': 'value', 'value': tracks},
+                               {'id': 'races-date-filter', 'property': 'start_date', 'value': None},
+                               {'id': 'races-date-filter', 'property': 'end_date', 'value': None}])
+        self.client.post("/_dash-update-component", json=body, name="races table")
+
+    @task(2)
+    def stable_page(self):
+        self.client.get("/stable")
+
+    @task(5)
+    def stable_table(self):
+        body = table_callback("stable-horses", random.randint(0, 5),
+                              random.choice([[], [{'column_id': 'horse_name', 'direction': 'asc'}]]))
+        self.client.post("/_dash-update-component", json=body, name="stable table")
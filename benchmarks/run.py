@@ -0,0 +1,250 @@
+"""benchmark harness for the Database layer and the schedule ETL against a local postgres
+
+    python -m benchmarks.run                       # ephemeral postgres via initdb/pg_ctl on PATH
+    python -m benchmarks.run --dsn-env --scratch-db tvg_bench   # the DB_* (+ PGPORT) server, in a scratch database
+    python -m benchmarks.run --scales 1000 100000 --compare benchmarks/results/<previous>.json
+
+loads sql/races.sql, sql/horses.sql, sql/aggregates.sql and sql/snapshots.sql into a scratch `tvg` schema, which is
+dropped and recreated, so it's only ever done on the ephemeral cluster or in the --scratch-db database (created
+if missing) of the --dsn-env server, never the app's own DB_NAME. Then it generates
+synthetic races/horses at each scale and times query/stream, insert_df, every upsert variant (both
+the executemany and COPY paths), _prep_df and the TVG parse pipeline (from --fixture, a recorded
+getFullScheduleRaces response, or synthetic payloads). Results are written as json to
+benchmarks/results/ so hot path regressions show up between commits.
+"""
+import argparse
+import atexit
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import re
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS = Path(__file__).resolve().parent / "results"
+SQL_FILES = ["races.sql", "horses.sql", "aggregates.sql", "snapshots.sql"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_ephemeral_postgres():
+    """initdb a throwaway cluster in a temp dir and start it on a free port, stopped at exit"""
+    if not shutil.which("initdb") or not shutil.which("pg_ctl"):
+        raise SystemExit("initdb/pg_ctl not on PATH, install postgres or pass --dsn-env")
+    data = tempfile.mkdtemp(prefix="bench-pg-")
+    port = free_port()
+    subprocess.run(["initdb", "-D", data, "-U", "bench", "--auth=trust", "-E", "UTF8"], check=True, 
+                   stdout=subprocess.DEVNULL)
+    subprocess.run(["pg_ctl", "-D", data, "-l", os.path.join(data, "log"), "-w", "start",
+                    "-o", f"-p {port} -k {data} -c fsync=off -c synchronous_commit=off -c full_page_writes=off"],
+                   check=True, stdout=subprocess.DEVNULL)
+    
+    def stop():
+        subprocess.run(["pg_ctl", "-D", data, "-m", "immediate", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(data, ignore_errors=True)
+    atexit.register(stop)
+    
+    os.environ.update({'DB_NAME': "postgres", 'DB_USER': "bench", 'DB_PWD': "", 
+                       'DB_URL': "127.0.0.1", 'PGPORT': str(port)})
+
+
+def use_scratch_database(name):
+    """point DB_NAME at the scratch database `name` on the DB_* server, creating it if it doesn't exist.
+    Refuses the app's configured database, load_schema() drops the tvg schema it's run in"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    if not name:
+        raise SystemExit("--dsn-env needs --scratch-db <name>, the benchmark drops and recreates the tvg schema")
+    if not re.fullmatch(r"\w+", name):
+        raise SystemExit(f"--scratch-db {name!r}: use a plain database name")
+    if name == os.getenv("DB_NAME"):
+        raise SystemExit(f"--scratch-db {name!r} is the app's DB_NAME, pick a database only the benchmark uses")
+    from psycopg import sql
+    from utils.database import Database
+    db = Database(min_size=1, max_size=1)
+    if not db.execute("SELECT 1 FROM pg_database WHERE datname = %s", [name]):
+        db.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+    os.environ['DB_NAME'] = name
+
+
+def load_schema(db):
+    db.execute("DROP SCHEMA IF EXISTS tvg CASCADE")
+    db.execute("CREATE SCHEMA tvg")
+    with db.transaction() as conn:
+        conn.execute("SET LOCAL search_path TO tvg")
+        for f in SQL_FILES:
+            conn.execute((ROOT / "sql" / f).read_text())
+    db.invalidate_meta()
+
+
+def make_races(n, seed=0):
+    rng = np.random.default_rng(seed)
+    tracks = np.array(["USA_BEL", "USA_SAR", "USA_AQU", "USA_SA", "GBR_ASC", "GBR_WOL"])
+    track = rng.choice(tracks, n)
+    day = pd.Timestamp("2024-01-01") + pd.to_timedelta(np.arange(n) // 600, unit="D")
+    number = np.arange(n) % 100 + 1
+    df = pd.DataFrame({
+        'track_id': track,
+        'race_date': day.date,
+        'post_time': day + pd.to_timedelta(rng.integers(12 * 60, 23 * 60, n), unit="min"),
+        'race_number': number,
+        'distance': rng.choice(["6f", "1m", "1 1/16m", "5 1/2f"], n),
+        'num_runners': rng.integers(5, 14, n),
+        'surface': rng.choice(["dirt", "turf", None], n),
+        'race_class': rng.choice(["maiden claiming", "allowance", "stakes"], n),
+    })
+    df['race_id'] = [f"{t}_{d}_{i}" for t, d, i in zip(df.track_id, df.race_date, np.arange(n))]
+    return df
+
+
+def make_horses(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'horse_id': np.arange(n),
+        'horse_name': [f"Horse {i}" for i in range(n)],
+        'foaling_date': pd.Timestamp("2018-01-01") + pd.to_timedelta(rng.integers(0, 2000, n), unit="D"),
+        'sex': rng.choice(["colt", "filly", "gelding", "mare", None], n),
+        'track_id': rng.choice(["USA_BEL", "USA_SAR", "GBR_ASC"], n),
+    })
+
+
+def schedule_payload(n, fixture=None):
+    if fixture:
+        with open(fixture) as f:
+            return json.load(f)
+    from benchmarks.tvg_stub import synthetic_races
+    return {'data': {'races': synthetic_races(n)}}
+
+
+def timeit(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {'min_s': min(times), 'median_s': statistics.median(times), 'mean_s': statistics.fmean(times), 
+            'repeat': repeat}
+
+
+def run_scale(db, n, repeat, fixture=None):
+    from etl.get_races import iter_parsed_races
+    
+    races, horses = make_races(n), make_horses(n)
+    dtypes = db._get_col_dtypes("tvg.horses")
+    truncate_races = lambda: db.execute("TRUNCATE tvg.races CASCADE")
+    truncate_horses = lambda: db.execute("TRUNCATE tvg.horses")
+    results = {}
+    
+    def case(name, fn, setup=None, rows=n):
+        r = timeit(fn, repeat, setup)
+        r['rows'] = rows
+        r['rows_per_s'] = rows / r['min_s'] if r['min_s'] else None
+        results[name] = r
+        print(f"  {name:<40} {r['min_s']:9.4f}s  {r['rows_per_s'] or 0:>14,.0f} rows/s")
+    
+    case("prep_df", lambda: db._df_rows(db._prep_frame(horses, dtypes)))
+    payload = schedule_payload(n, fixture)
+    n_payload = len(payload['data']['races'])
+    case("parse_tvg_race_schedule", lambda: list(iter_parsed_races(payload['data']['races'], Counter())), 
+         rows=n_payload)
+    
+    case("insert_df", lambda: db.insert_df(horses, "tvg.horses"), setup=truncate_horses)
+    for method in ("executemany", "copy"):
+        # insert path (empty table) then conflict path (every row exists)
+        case(f"upsert_df[{method}] insert", lambda: db.upsert_df(races, "tvg.races", method=method), 
+             setup=truncate_races)
+        case(f"upsert_df[{method}] update", lambda: db.upsert_df(races, "tvg.races", method=method))
+        case(f"upsert_df_except_null[{method}]", lambda: db.upsert_df_except_null(races, "tvg.races", method=method))
+        case(f"upsert_df_only_null[{method}]", lambda: db.upsert_df_only_null(races, "tvg.races", method=method))
+        records = races.to_dict("records")
+        case(f"upsert[{method}]", lambda: db.upsert(records, "tvg.races", method=method))
+    
+    db.execute("ANALYZE tvg.races")
+    case("query as_df", lambda: db.query("SELECT * FROM tvg.races"))
+    case("query_df copy out", lambda: db.query_df("SELECT * FROM tvg.races", table="tvg.races"))
+    case("query as dicts", lambda: db.query("SELECT * FROM tvg.races", as_df=False))
+    case("stream tuples", lambda: sum(len(b) for b in db.stream("SELECT * FROM tvg.races", as_="tuple")))
+    case("query by track", lambda: db.query("SELECT * FROM tvg.races WHERE track_id=ANY(%(tracks)s)", 
+                                            {'tracks': ["USA_BEL"]}), rows=int((races.track_id == "USA_BEL").sum()))
+    return results
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, 
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nvs {previous_path} ({previous['meta']['git_rev']}): ratio of min times, >1 is slower")
+    for scale, cases in current['results'].items():
+        for name, r in cases.items():
+            prev = previous['results'].get(scale, {}).get(name)
+            if prev:
+                ratio = r['min_s'] / prev['min_s'] if prev['min_s'] else float("nan")
+                flag = "  <-- regression" if ratio > 1.2 else ""
+                print(f"  {scale:>8} {name:<40} {ratio:6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", nargs="+", type=int, default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fixture", help="recorded getFullScheduleRaces response json for the parse benchmark")
+    parser.add_argument("--dsn-env", action="store_true", help="use DB_* env vars instead of an ephemeral postgres")
+    parser.add_argument("--scratch-db", help="with --dsn-env: database to run in (created if missing), "
+                                             "must not be DB_NAME")
+    parser.add_argument("--out", help="results json path, defaults to benchmarks/results/<time>_<rev>.json")
+    parser.add_argument("--compare", help="previous results json to compare against")
+    args = parser.parse_args()
+    
+    if args.dsn_env:
+        use_scratch_database(args.scratch_db)
+    else:
+        start_ephemeral_postgres()
+    # imported after the env is set up since Database reads DB_* on construction
+    from utils.database import Database
+    db = Database()
+    load_schema(db)
+    
+    out = {'meta': {'git_rev': git_rev(), 'time': datetime.datetime.utcnow().isoformat(), 
+                    'python': platform.python_version(), 'pandas': pd.__version__, 
+                    'postgres': db.execute("SHOW server_version", flatten=True)[0],
+                    'repeat': args.repeat, 'fixture': args.fixture},
+           'results': {}}
+    for n in args.scales:
+        print(f"scale {n:,}")
+        out['results'][str(n)] = run_scale(db, n, args.repeat, args.fixture)
+    
+    RESULTS.mkdir(exist_ok=True)
+    path = Path(args.out) if args.out else RESULTS / f"{datetime.datetime.utcnow():%Y%m%dT%H%M%S}_{out['meta']['git_rev']}.json"
+    path.write_text(json.dumps(out, indent=2))
+    print(f"\nwrote {path}")
+    if args.compare:
+        compare(out, args.compare)
+    db.execute("DROP SCHEMA IF EXISTS tvg CASCADE")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""local stand-in for the TVG GraphQL endpoint serving recorded (or synthetic) schedule responses
+
+    python -m benchmarks.tvg_stub --port 8765 --fixture recorded_schedule.json
+    TVG_URL=http://127.0.0.1:8765/graph/v2/query python etl/get_races.py
+
+honours the $pagination ({current, results}) and filterBy.trackCode variables, gzips when asked
+and can add per-request latency to mimic the real service
+"""
+import argparse
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def synthetic_races(n):
+    tracks = [("BEL", "USA"), ("SAR", "USA"), ("AQU", "USA"), ("ASC", "GBR"), ("WOL", "GBR"), ("SA", "USA")]
+    races = []
+    for i in range(n):
+        code, country = tracks[i % len(tracks)]
+        day = 1 + (i // 600) % 28
+        races.append({
+            'number': str(1 + (i // len(tracks)) % 100),
+            'distance': "6f",
+            'numRunners': str(6 + i % 8),
+            'postTime': f"2024-01-{day:02d}T{12 + i % 10}:{i % 60:02d}:00-05:00",
+            'mtp': i % 60,
+            'isGreyhound': False,
+            'track': {'code': code, 'name': code, 'featured': False, 'perfAbbr': "Day",
+                      'location': {'country': country, '__typename': "Location"}, '__typename': "Track"},
+            'raceClass': {'id': "1", 'name': "Maiden Claiming", '__typename': "RaceClass"},
+            'surface': {'id': "1", 'code': "D", 'name': "Dirt", '__typename': "Surface"},
+            'video': {'onTvg': True, 'onTvg2': False, 'liveStreaming': True, 'hasReplay': False,
+                      'streams': [], 'replays': [], '__typename': "Video"},
+            '__typename': "Race",
+        })
+    return races
+
+
+def make_handler(races, latency=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('content-length', 0))) or b"{}")
+            variables = body.get('variables') or {}
+            data = races
+            tracks = (variables.get('filterBy') or {}).get('trackCode')
+            if tracks:
+                data = [r for r in data if r['track']['code'] in tracks]
+            page = variables.get('pagination')
+            if page:
+                start = page['current'] * page['results']
+                data = data[start:start + page['results']]
+            if latency:
+                time.sleep(latency)
+            
+            out = json.dumps({'data': {'races': data}}).encode()
+            self.send_response(200)
+            self.send_header('content-type', 'application/json')
+            if 'gzip' in self.headers.get('accept-encoding', ''):
+                out = gzip.compress(out, compresslevel=5)
+                self.send_header('content-encoding', 'gzip')
+            self.send_header('content-length', str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+        
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def serve(races, port=0, latency=0.0):
+    """start the stub on a daemon thread, returns (server, url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(races, latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/graph/v2/query"
+
+
+def load_fixture(path):
+    with open(path) as f:
+        return json.load(f)['data']['races']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixture", help="recorded getFullScheduleRaces response json")
+    parser.add_argument("--races", type=int, default=2000, help="synthetic races when no fixture is given")
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    races = load_fixture(args.fixture) if args.fixture else synthetic_races(args.races)
+    server, url = serve(races, args.port, args.latency)
+    print(f"serving {len(races)} races on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""append-only archive of raw TVG schedule payloads, so new fields can be backfilled by replaying them
+
+every fetched schedule is stored as one compressed jsonl snapshot (a raw race dict per line) under
+a date partition, and listed in index.jsonl by fetch time:
+
+    <root>/date=2024-01-01/20240101T120000.000000Z-<pid>.jsonl.gz
+    <root>/index.jsonl    {"fetched_at": ..., "path": ..., "races": ..., "bytes": ...}
+
+root defaults to $TVG_ARCHIVE_DIR (./data/tvg_archive), compression to $TVG_ARCHIVE_COMPRESSION
+('gzip', or 'zstd' when zstandard is installed)
+"""
+import os
+import gzip
+import json
+import datetime
+import threading
+from pathlib import Path
+try:
+    # optional, smaller and faster than gzip
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_DIR = os.getenv("TVG_ARCHIVE_DIR", "data/tvg_archive")
+EXTENSIONS = {'gzip': ".jsonl.gz", 'zstd': ".jsonl.zst"}
+
+
+def _open(path, mode, compression):
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6)
+    if zstandard is None:
+        raise RuntimeError("zstd archives need the zstandard package")
+    return zstandard.open(path, mode + "t", encoding="utf-8")
+
+
+def _compression(path):
+    return "zstd" if str(path).endswith(EXTENSIONS['zstd']) else "gzip"
+
+
+class PayloadArchive:
+    """write and read archived schedule snapshots. Snapshots are written to a temp file and only
+    renamed into place and indexed once complete, so an aborted fetch leaves nothing behind"""
+
+    _index_lock = threading.Lock()
+
+    def __init__(self, root=None, compression=None):
+        self.root = Path(root or ARCHIVE_DIR)
+        self.compression = compression or os.getenv("TVG_ARCHIVE_COMPRESSION", "gzip")
+        if self.compression not in EXTENSIONS:
+            raise ValueError(f"unknown archive compression {self.compression}")
+
+    @property
+    def index_path(self):
+        return self.root / "index.jsonl"
+
+    def tee(self, races, fetched_at=None):
+        """yield races unchanged while archiving them as one snapshot, indexed when the stream is exhausted"""
+        fetched_at = fetched_at or datetime.datetime.now(datetime.timezone.utc)
+        part = self.root / f"date={fetched_at:%Y-%m-%d}"
+        part.mkdir(parents=True, exist_ok=True)
+        path = part / f"{fetched_at:%Y%m%dT%H%M%S.%fZ}-{os.getpid()}{EXTENSIONS[self.compression]}"
+        tmp = path.with_name(path.name + ".tmp")
+        n = 0
+        try:
+            with _open(tmp, "w", self.compression) as f:
+                for d in races:
+                    f.write(json.dumps(d, separators=(",", ":")) + "\n")
+                    n += 1
+                    yield d
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        tmp.rename(path)
+        self._index({'fetched_at': fetched_at.isoformat(), 'path': str(path.relative_to(self.root)),
+                     'races': n, 'bytes': path.stat().st_size})
+
+    def write(self, races, fetched_at=None):
+        """archive a whole list of raw races as one snapshot"""
+        for _ in self.tee(races, fetched_at):
+            pass
+
+    def _index(self, entry):
+        with self._index_lock, open(self.index_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def snapshots(self, start=None, end=None):
+        """index entries with start <= fetched_at < end (datetimes, dates or iso strings), oldest first"""
+        if not self.index_path.exists():
+            return []
+        start, end = (str(x.isoformat() if hasattr(x, "isoformat") else x) if x else None for x in (start, end))
+        with open(self.index_path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        return sorted((e for e in entries if (start is None or e['fetched_at'] >= start)
+                       and (end is None or e['fetched_at'] < end)), key=lambda e: e['fetched_at'])
+
+    def read(self, entry):
+        """yield the raw race dicts of one snapshot (an index entry or a path relative to root)"""
+        path = self.root / (entry['path'] if isinstance(entry, dict) else entry)
+        with _open(path, "r", _compression(path)) as f:
+            for line in f:
+                yield json.loads(line)
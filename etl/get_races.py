@@ -1,5 +1,10 @@
 import sys
-import requests
+import json
+import hashlib
+import datetime
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from psycopg import sql
 from prefect import flow
 from prefect import flow, get_run_logger, task
 from prefect.deployments.deployments import Deployment
@@ -7,86 +12,334 @@ from prefect.server.schemas.schedules import CronSchedule
 
 try:
     from utils.database import Database
+    from utils.live import notify_races
+    from utils.aggregates import refresh_race_summary
+    from utils.snapshots import append_snapshots
+    from etl.tvg import get_client, merge_pages
+    from etl.archive import PayloadArchive
 except ModuleNotFoundError:    
     sys.path.append("..")
     from utils.database import Database
+    from utils.live import notify_races
+    from utils.aggregates import refresh_race_summary
+    from utils.snapshots import append_snapshots
+    from etl.tvg import get_client, merge_pages
+    from etl.archive import PayloadArchive
 
 
 
 @task
-def get_tvg_race_schedule():
-    """get race schedule from tvg"""
-    
-    headers = {
-        'authority': 'service.tvg.com',
-        'accept': '*/*',
-        'accept-language': 'en-US,en;q=0.5',
-        'content-type': 'application/json',
-        'dnt': '1',
-        'origin': 'https://www.tvg.com',
-        'referer': 'https://www.tvg.com/',
-        'sec-ch-ua': '"Not/A)Brand";v="99", "Brave";v="115", "Chromium";v="115"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"macOS"',
-        'sec-fetch-dest': 'empty',
-        'sec-fetch-mode': 'cors',
-        'sec-fetch-site': 'same-site',
-        'sec-gpc': '1',
-        'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36',
-    }
-
-    json_data = {
-        'query': 'query getFullScheduleRaces($wagerProfile: String, $sortBy: RaceListSort, $filterBy: RaceListFilter, $pagination: Pagination) {\n  races(sort: $sortBy, filter: $filterBy, profile: $wagerProfile, page: $pagination) {\n    number\n    distance\n    numRunners\n    postTime\n    mtp\n    isGreyhound\n    track {\n      code\n      name\n      featured\n      perfAbbr\n      location {\n        country\n        __typename\n      }\n      __typename\n    }\n    raceClass {\n      id\n      name\n      __typename\n    }\n    surface {\n      id\n      code\n      name\n      __typename\n    }\n    video {\n      onTvg\n      onTvg2\n      liveStreaming\n      hasReplay\n      streams\n      replays\n      __typename\n    }\n    __typename\n  }\n}\n',
-        'variables': {
-            'wagerProfile': 'PORT-NY',
-            'filterBy': {
-                'hasMTP': True,
-                'isOpen': True,
-            },
-            'sortBy': {
-                'byPostTime': 'ASC',
-            },
-        },
-        'operationName': 'getFullScheduleRaces',
-    }
+def get_tvg_race_schedule(page_size=None):
+    """get race schedule from tvg, in one request or page by page when page_size is set"""
     logger = get_run_logger()
     logger.info("Fetching races from tvg")
-    r = requests.post('https://service.tvg.com/graph/v2/query', headers=headers, json=json_data)
-    r.raise_for_status()
-    return r.json()
+    client = get_client()
+    if page_size:
+        data = merge_pages(client.race_schedule_pages(page_size=page_size))
+    else:
+        data = client.race_schedule()
+    PayloadArchive().write((data.get('data') or {}).get('races') or [])
+    return data
+
+
+
+def parse_post_time(s):
+    """TVG postTime ('2024-01-01T13:01:00-05:00') -> naive UTC datetime, which is how post_time is stored.
+    A timestamp column would keep the local wall time and drop the offset"""
+    t = datetime.datetime.fromisoformat(s.replace("Z", "+00:00"))
+    return t.astimezone(datetime.timezone.utc).replace(tzinfo=None) if t.tzinfo else t
+
+
+def parse_tvg_race(d):
+    """normalise one TVG race, raises KeyError/TypeError/AttributeError/ValueError on records missing required 
+    fields or with an unparseable postTime. surface and race class are optional and come back as None when 
+    TVG leaves them out. race_date stays the track's local date"""
+    surface = (d.get('surface') or {}).get('name')
+    race_class = (d.get('raceClass') or {}).get('name')
+    r = {'race_number': d['number'],
+         'distance': d['distance'],
+         'num_runners': d['numRunners'],
+         'race_date': d['postTime'][:10],
+         'post_time': parse_post_time(d['postTime']),
+         'track_id': f"{d['track']['location']['country']}_{d['track']['code']}",
+         "surface": surface.lower() if surface else None,
+         "race_class": race_class.lower() if race_class else None}
+    r['race_id'] = f"{r['track_id']}_{r['race_date']}_{r['race_number']}"
+    return r
+
+
+def iter_parsed_races(items, stats, parse=parse_tvg_race):
+    """parse raw race dicts lazily, counting malformed records in stats instead of failing the run"""
+    for d in items:
+        try:
+            r = parse(d)
+        except (KeyError, TypeError, AttributeError, ValueError):
+            stats['malformed'] += 1
+            continue
+        stats['parsed'] += 1
+        stats['missing_surface'] += r['surface'] is None
+        stats['missing_race_class'] += r['race_class'] is None
+        yield r
+
+
+def snapshot_row(d, captured_at):
+    """polled state of one raw TVG race for tvg.race_snapshots"""
+    r = parse_tvg_race(d)
+    return {'captured_at': captured_at, 'race_id': r['race_id'], 'track_id': r['track_id'], 
+            'race_date': r['race_date'], 'post_time': r['post_time'], 'mtp': d.get('mtp'), 
+            'num_runners': r['num_runners']}
+
+
+def capture_snapshots(items, out, captured_at):
+    """pass raw race dicts through, appending each one's snapshot_row to out. Malformed ones are skipped,
+    iter_parsed_races counts them"""
+    for d in items:
+        try:
+            out.append(snapshot_row(d, captured_at))
+        except (KeyError, TypeError, AttributeError, ValueError):
+            pass
+        yield d
+
 
+def batched(iterable, n):
+    batch = []
+    for x in iterable:
+        batch.append(x)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 @task
 def parse_tvg_race_schedule(data):
     logger = get_run_logger()
-    races = []
-    for d in data.get('data',{}).get('races',[]):
-        r = {'race_number': d['number'],
-             'distance': d['distance'],
-             'num_runners': d['numRunners'],
-             'race_date': d['postTime'][:10],
-             'post_time': d['postTime'],
-             'track_id': f"{d['track']['location']['country']}_{d['track']['code']}",
-             "surface": d['surface']['name'].lower(),
-             "race_class": d['raceClass']['name'].lower()}
-        r['race_id'] = f"{r['track_id']}_{r['race_date']}_{r['race_number']}"
-        races.append(r)
-    logger.info(f"{len(races)} races parsed")
+    stats = Counter()
+    races = list(iter_parsed_races(data.get('data',{}).get('races',[]), stats))
+    logger.info(f"{len(races)} races parsed, {stats['malformed']} malformed")
     return races
     
 
+def race_fingerprint(race):
+    """stable hash of a parsed race record"""
+    return hashlib.sha1(json.dumps(race, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_race_fingerprints(db):
+    """{race_id: fingerprint} for races still on the open schedule"""
+    data = db.query("SELECT race_id, fingerprint FROM tvg.race_schedule WHERE removed_at IS NULL", as_df=False)
+    return {d['race_id']: d['fingerprint'] for d in data}
+
+
+def diff_races(races, known):
+    """split parsed races into new / changed / unchanged against known fingerprints"""
+    new, changed, unchanged = [], [], []
+    for r in races:
+        fp = known.get(r['race_id'])
+        if fp is None:
+            new.append(r)
+        elif fp != race_fingerprint(r):
+            changed.append(r)
+        else:
+            unchanged.append(r)
+    return new, changed, unchanged
+
+
+# first_seen is only set when a race is first inserted, a write reopens a race that had dropped off
+SCHEDULE_UPSERT = """INSERT INTO tvg.race_schedule (race_id, fingerprint, first_seen, changed_at, removed_at)
+                     VALUES (%(race_id)s, %(fingerprint)s, %(changed_at)s, %(changed_at)s, NULL)
+                     ON CONFLICT (race_id) DO UPDATE 
+                     SET fingerprint = excluded.fingerprint, changed_at = excluded.changed_at, removed_at = NULL"""
+
+
+@task
+def write_race_batch(races, known, db, captured_at=None):
+    """upsert the new/changed races in one parsed batch and record their fingerprints.
+    captured_at (naive UTC) is when the poll was fetched, stored as race_schedule.changed_at (and first_seen
+    for new races) so it's on the same clock as the archived snapshot's fetched_at that replay_race_archive 
+    compares it with.
+    Returns the counts plus {race_id: fingerprint} of what was written, which the flow merges into known 
+    so a race repeated later in the stream isn't rewritten. known isn't mutated here, prefect hands 
+    tasks a rebuilt copy of their collection inputs"""
+    # the same race can show up twice in a batch, last one wins like the upsert did
+    races = list({r['race_id']: r for r in races}.values())
+    new, changed, unchanged = diff_races(races, known)
+    to_write = new + changed
+    fingerprints = {}
+    if to_write:
+        db.upsert(to_write, table="tvg.races", pkeys=['race_id'])
+        changed_at = captured_at or datetime.datetime.utcnow()
+        fingerprints = {r['race_id']: race_fingerprint(r) for r in to_write}
+        with db.transaction() as conn, conn.cursor() as cur:
+            cur.executemany(SCHEDULE_UPSERT, [{'race_id': race_id, 'fingerprint': fp, 'changed_at': changed_at}
+                                              for race_id, fp in sorted(fingerprints.items())])
+        # live boards re-read just these races
+        notify_races(db, list(fingerprints))
+        # chart summaries for the days these races run on
+        refresh_race_summary(db, {r['race_date'] for r in to_write})
+    return {'inserted': len(new), 'updated': len(changed), 'unchanged': len(unchanged), 
+            'fingerprints': fingerprints}
+
+
 @flow(retries=3, retry_delay_seconds=60)
-def update_scheduled_races():
-    races = get_tvg_race_schedule()
-    races = parse_tvg_race_schedule(races)
+def update_scheduled_races(batch_size=500, page_size=None, archive=True):
+    """stream the schedule from tvg -> parse race by race -> write new/changed races in batches,
+    so races land before the whole payload is parsed and memory stays flat.
+    With archive the raw races are also saved to the PayloadArchive for replay_race_archive.
+    Every polled race is appended to tvg.race_snapshots, unchanged ones included"""
+    logger = get_run_logger()
     db = Database()
-    db.upsert(races, table="tvg.races", pkeys=['race_id'])
+    known = load_race_fingerprints(db)
+    active = set(known)
+    seen = set()
+    stats = Counter()
+    
+    # one capture time for the archive, the snapshots and race_schedule.changed_at
+    fetched_at = datetime.datetime.now(datetime.timezone.utc)
+    captured_at = fetched_at.replace(tzinfo=None)
+    raw = get_client().iter_race_schedule(page_size=page_size)
+    if archive:
+        raw = PayloadArchive().tee(raw, fetched_at)
+    snapshots = []
+    raw = capture_snapshots(raw, snapshots, captured_at)
+    races = iter_parsed_races(raw, stats)
+    for batch in batched(races, batch_size):
+        seen.update(r['race_id'] for r in batch)
+        result = write_race_batch(batch, known, db, captured_at)
+        known.update(result.pop('fingerprints'))
+        stats.update(result)
+        stats['batches'] += 1
+        append_snapshots(db, snapshots)
+        stats['snapshots'] += len(snapshots)
+        snapshots.clear()
+    
+    # a poll that yields no races at all is a bad response, not every race closing at once
+    removed = list(active - seen) if seen else []
+    if not seen and active:
+        logger.warning(f"race schedule: no races fetched, keeping the {len(active)} open races")
+    if removed:
+        db.execute("UPDATE tvg.race_schedule SET removed_at = %(removed_at)s WHERE race_id = ANY(%(race_ids)s)", 
+                   {'race_ids': removed, 'removed_at': captured_at})
+        notify_races(db, removed)
+    
+    summary = {k: stats[k] for k in ('inserted', 'updated', 'unchanged', 'malformed', 'missing_surface', 
+                                     'missing_race_class', 'batches', 'snapshots')}
+    summary['removed'] = len(removed)
+    logger.info(f"race schedule: {summary}")
+    return summary
    
 
+def parse_snapshot(root, entry, parse=parse_tvg_race):
+    """(parsed races, stats) for one archived snapshot, run in a worker process by replay_race_archive"""
+    stats = Counter()
+    return list(iter_parsed_races(PayloadArchive(root).read(entry), stats, parse)), stats
+
+
+REPLAY_STATE_SQL = """SELECT race_id, changed_at FROM tvg.race_schedule 
+                      WHERE race_id = ANY(%(race_ids)s) FOR UPDATE"""
+
+# races replayed for the first time are history, not on the open schedule, so they start removed.
+# existing rows keep first_seen/removed_at, the live ETL reopens a race when it polls it again
+REPLAY_SCHEDULE_UPSERT = """INSERT INTO tvg.race_schedule (race_id, fingerprint, first_seen, changed_at, removed_at)
+                            VALUES (%(race_id)s, %(fingerprint)s, %(changed_at)s, %(changed_at)s, %(removed_at)s)
+                            ON CONFLICT (race_id) DO UPDATE 
+                            SET fingerprint = excluded.fingerprint, changed_at = excluded.changed_at"""
+
+
+def replay_upsert_query(cols):
+    return sql.SQL("INSERT INTO tvg.races ({cols}) VALUES ({vals}) ON CONFLICT (race_id) DO UPDATE SET {sets}").format(
+        cols=sql.SQL(", ").join(map(sql.Identifier, cols)),
+        vals=sql.SQL(", ").join(map(sql.Placeholder, cols)),
+        sets=sql.SQL(", ").join(sql.SQL("{0} = excluded.{0}").format(sql.Identifier(c)) for c in cols if c != 'race_id'))
+
+
+def write_replayed_races(db, races, cols):
+    """upsert [(fetched_at, race)] into tvg.races and their race_schedule fingerprints in one transaction,
+    skipping races whose stored row was written after the snapshot was fetched. Live writes stamp changed_at 
+    with their poll's fetched_at, so the snapshot that made a change compares equal and is written. 
+    Returns the races written"""
+    removed_at = datetime.datetime.utcnow()
+    with db.transaction() as conn:
+        stored = dict(conn.execute(REPLAY_STATE_SQL, {'race_ids': [r['race_id'] for _, r in races]}).fetchall())
+        fresh = [(t, r) for t, r in races if stored.get(r['race_id']) is None or stored[r['race_id']] <= t]
+        if fresh:
+            with conn.cursor() as cur:
+                cur.executemany(replay_upsert_query(cols), [{c: r.get(c) for c in cols} for _, r in fresh])
+                cur.executemany(REPLAY_SCHEDULE_UPSERT, [{'race_id': r['race_id'], 'fingerprint': race_fingerprint(r),
+                                                          'changed_at': t, 'removed_at': removed_at} 
+                                                         for t, r in fresh])
+    return [r for _, r in fresh]
+
+
+def _fetched_at(entry):
+    # race_schedule times are naive UTC
+    t = datetime.datetime.fromisoformat(entry['fetched_at'])
+    return t.astimezone(datetime.timezone.utc).replace(tzinfo=None) if t.tzinfo else t
+
+
+@flow
+def replay_race_archive(start=None, end=None, parse=parse_tvg_race, batch_size=5000, workers=None, root=None):
+    """re-run parse -> load over archived snapshots fetched in [start, end), e.g. to backfill a column
+    after parse_tvg_race learns a new field. Snapshots are parsed in parallel across processes, 
+    then replayed oldest first so each race ends up as its latest archived version. 
+    A race is only written when its stored row (race_schedule.changed_at) isn't newer than the snapshot, 
+    so replaying an old range can't revert current data, and its fingerprint is updated with it so the 
+    live ETL diffs against what's actually stored. parse must be a module level function so it can be 
+    sent to the workers"""
+    logger = get_run_logger()
+    archive = PayloadArchive(root)
+    entries = archive.snapshots(start, end)
+    latest = {}
+    stats = Counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(parse_snapshot, [archive.root] * len(entries), entries, [parse] * len(entries))
+        for entry, (races, s) in zip(entries, results):
+            fetched_at = _fetched_at(entry)
+            latest.update((r['race_id'], (fetched_at, r)) for r in races)
+            stats.update(s)
+    
+    db = Database()
+    table_cols = db.get_cols("tvg.races")
+    written = []
+    for batch in batched(list(latest.values()), batch_size):
+        cols = [c for c in table_cols if any(c in r for _, r in batch)]
+        written += write_replayed_races(db, batch, cols)
+    refresh_race_summary(db, {r['race_date'] for r in written})
+    
+    summary = {'snapshots': len(entries), 'races': len(latest), 'written': len(written), 
+               'skipped_newer': len(latest) - len(written), 'parsed': stats['parsed'], 
+               'malformed': stats['malformed']}
+    logger.info(f"race archive replay: {summary}")
+    return summary
+
+
+# (minutes to the next post time, seconds between schedule polls), first match wins
+POLL_CADENCE = [(5, 30), (15, 60), (60, 300)]
+IDLE_POLL_SECONDS = 900
+
+
+def race_schedule_cadence(db):
+    """seconds until the schedule should be polled again, tighter as the next post time approaches.
+    post_time is stored as UTC"""
+    data = db.query("""SELECT EXTRACT(EPOCH FROM min(post_time) - (now() AT TIME ZONE 'UTC')) / 60 AS mtp
+                       FROM tvg.races WHERE post_time > now() AT TIME ZONE 'UTC'""", as_df=False)
+    mtp = data[0]['mtp'] if data else None
+    if mtp is None:
+        return IDLE_POLL_SECONDS
+    for minutes, seconds in POLL_CADENCE:
+        if mtp <= minutes:
+            return seconds
+    return IDLE_POLL_SECONDS
+
+
 if __name__ == "__main__":
     
-    update_scheduled_races()
+    # python -m etl.get_races replay [start] [end]   backfill tvg.races from the payload archive
+    if sys.argv[1:2] == ["replay"]:
+        replay_race_archive(*sys.argv[2:4])
+    else:
+        update_scheduled_races()
     # Deployment.build_from_flow(
     #     update_scheduled_races,
     #     schedule=(CronSchedule(cron="0 0 * * *", timezone="America/New_York"))
@@ -0,0 +1,215 @@
+"""pooled, retrying client for the TVG GraphQL api"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+try:
+    # optional, lets a schedule be decoded race by race as the response streams in
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+TVG_URL = os.getenv("TVG_URL", "https://service.tvg.com/graph/v2/query")
+
+HEADERS = {
+    'authority': 'service.tvg.com',
+    'accept': '*/*',
+    'accept-encoding': 'gzip, deflate',
+    'accept-language': 'en-US,en;q=0.5',
+    'content-type': 'application/json',
+    'dnt': '1',
+    'origin': 'https://www.tvg.com',
+    'referer': 'https://www.tvg.com/',
+    'sec-ch-ua': '"Not/A)Brand";v="99", "Brave";v="115", "Chromium";v="115"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"macOS"',
+    'sec-fetch-dest': 'empty',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-site': 'same-site',
+    'sec-gpc': '1',
+    'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36',
+}
+
+RACE_SCHEDULE_QUERY = 'query getFullScheduleRaces($wagerProfile: String, $sortBy: RaceListSort, $filterBy: RaceListFilter, $pagination: Pagination) {\n  races(sort: $sortBy, filter: $filterBy, profile: $wagerProfile, page: $pagination) {\n    number\n    distance\n    numRunners\n    postTime\n    mtp\n    isGreyhound\n    track {\n      code\n      name\n      featured\n      perfAbbr\n      location {\n        country\n        __typename\n      }\n      __typename\n    }\n    raceClass {\n      id\n      name\n      __typename\n    }\n    surface {\n      id\n      code\n      name\n      __typename\n    }\n    video {\n      onTvg\n      onTvg2\n      liveStreaming\n      hasReplay\n      streams\n      replays\n      __typename\n    }\n    __typename\n  }\n}\n'
+
+RACE_SCHEDULE_VARIABLES = {
+    'wagerProfile': 'PORT-NY',
+    'filterBy': {
+        'hasMTP': True,
+        'isOpen': True,
+    },
+    'sortBy': {
+        'byPostTime': 'ASC',
+    },
+}
+
+
+class TVGResponseError(RuntimeError):
+    """a 200 response that isn't a usable result: GraphQL errors or no data. Raised instead of reading 
+    it as an empty schedule, which would close every open race"""
+
+
+def check_response(payload):
+    """payload, raising TVGResponseError when it carries errors or no data"""
+    if not isinstance(payload, dict):
+        raise TVGResponseError(f"unexpected TVG response: {payload!r:.200}")
+    if payload.get('errors'):
+        raise TVGResponseError(f"TVG returned errors: {payload['errors']!r:.500}")
+    if payload.get('data') is None:
+        raise TVGResponseError("TVG response has no data")
+    return payload
+
+
+def _build(event, value, events):
+    """the complete json value that starts with (event, value), consuming the rest of its events"""
+    builder = ObjectBuilder()
+    depth = 0
+    while True:
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        if depth == 0:
+            return builder.value
+        _, event, value = next(events)
+
+
+def iter_streamed_races(f):
+    """yield data.races items from a streamed schedule response as each one is decoded, with the same 
+    checks as check_response: errors raise as soon as they're read (GraphQL puts them first), 
+    missing/null data once the stream ends"""
+    events = ijson.parse(f, use_float=True)
+    has_data = False
+    for prefix, event, value in events:
+        if prefix == 'data.races.item':
+            yield _build(event, value, events)
+        elif prefix == 'data' and event == 'start_map':
+            has_data = True
+        elif prefix == 'errors' and event != 'map_key':
+            errors = _build(event, value, events)
+            if errors:
+                raise TVGResponseError(f"TVG returned errors: {errors!r:.500}")
+    if not has_data:
+        raise TVGResponseError("TVG response has no data")
+
+
+class TVGClient:
+    """keep-alive session for the TVG GraphQL endpoint with gzip, timeouts,
+    retries with exponential backoff on connection errors/429/5xx, and concurrent
+    page or per-track fetching on a thread pool. Thread safe.
+    
+    url defaults to $TVG_URL so it can be pointed at a local stub server"""
+    
+    def __init__(self, url=None, timeout=(5, 30), retries=3, backoff_factor=0.5, max_workers=4):
+        self.url = url or TVG_URL
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        retry = Retry(total=retries, backoff_factor=backoff_factor, 
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=None,  # POST is how graphql reads, retry it too
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+    
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tvg")
+        return self._pool
+    
+    def query(self, query, variables=None, operation_name=None):
+        """POST one GraphQL query, returns the decoded json payload. 
+        Raises TVGResponseError when it has errors or no data"""
+        json_data = {'query': query, 'variables': variables or {}}
+        if operation_name:
+            json_data['operationName'] = operation_name
+        r = self.session.post(self.url, json=json_data, timeout=self.timeout)
+        r.raise_for_status()
+        return check_response(r.json())
+    
+    def race_schedule(self, variables=None):
+        """full open race schedule in one request"""
+        return self.query(RACE_SCHEDULE_QUERY, variables or RACE_SCHEDULE_VARIABLES, 'getFullScheduleRaces')
+    
+    def iter_race_schedule(self, variables=None, page_size=None):
+        """yield raw race dicts as they're decoded. With page_size each page is decoded on its own,
+        otherwise the single response is parsed incrementally with ijson (when installed) 
+        so memory doesn't grow with the schedule"""
+        if page_size:
+            for data in self.race_schedule_pages(page_size=page_size, variables=variables):
+                yield from ((data or {}).get('data') or {}).get('races') or []
+            return
+        if ijson is None:
+            yield from (self.race_schedule(variables).get('data') or {}).get('races') or []
+            return
+        json_data = {'query': RACE_SCHEDULE_QUERY, 'variables': variables or RACE_SCHEDULE_VARIABLES, 
+                     'operationName': 'getFullScheduleRaces'}
+        with self.session.post(self.url, json=json_data, timeout=self.timeout, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True  # gunzip on the fly
+            yield from iter_streamed_races(r.raw)
+    
+    def race_schedule_pages(self, page_size=100, variables=None, max_pages=1000):
+        """yield schedule payloads page by page, max_workers pages in flight at a time, 
+        stops at the first short page. Pages use the query's $pagination ({current, results})"""
+        variables = variables or RACE_SCHEDULE_VARIABLES
+        page = 0
+        while page < max_pages:
+            batch = range(page, min(page + self.max_workers, max_pages))
+            futures = [self.pool.submit(self.race_schedule, {**variables, 'pagination': {'current': p, 'results': page_size}})
+                       for p in batch]
+            for f in futures:
+                data = f.result()
+                yield data
+                if len(((data or {}).get('data') or {}).get('races') or []) < page_size:
+                    for rest in futures:
+                        rest.cancel()
+                    return
+            page += len(batch)
+    
+    def race_schedule_for_tracks(self, tracks, variables=None):
+        """{track code: payload}, one concurrent request per track"""
+        variables = variables or RACE_SCHEDULE_VARIABLES
+        futures = {t: self.pool.submit(self.race_schedule, 
+                                       {**variables, 'filterBy': {**variables.get('filterBy', {}), 'trackCode': [t]}})
+                   for t in tracks}
+        return {t: f.result() for t, f in futures.items()}
+    
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+def merge_pages(pages):
+    """combine paged schedule payloads into one {'data': {'races': [...]}} payload"""
+    races = []
+    for p in pages:
+        races.extend(((p or {}).get('data') or {}).get('races') or [])
+    return {'data': {'races': races}}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """process wide client so connections are reused across flow runs"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TVGClient()
+    return _client
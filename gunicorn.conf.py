@@ -0,0 +1,18 @@
+"""gunicorn -c gunicorn.conf.py, settings can be overridden with the usual GUNICORN_CMD_ARGS or the env vars below"""
+import os
+import multiprocessing
+
+wsgi_app = "wsgi:server"
+bind = os.getenv("BIND", "0.0.0.0:8050")
+# processes for cpu bound dash/plotly work, threads for waiting on postgres
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 4))
+timeout = int(os.getenv("WEB_TIMEOUT", 60))
+keepalive = 5
+# recycle workers now and then so slow leaks can't build up
+max_requests = 2000
+max_requests_jitter = 200
+# no preload, so connection pools and the live board listener are created in each worker after the fork
+preload_app = False
+accesslog = "-"
@@ -1,10 +1,17 @@
 import pprint
-import pandas as pd
-import plotly.express as px
+from collections import Counter
 import dash, dash_table
 import dash_bootstrap_components as dbc
-from dash import html, dcc, Input, Output, callback
+from dash import html, dcc, Input, Output, State, callback, ctx
+from dash.exceptions import PreventUpdate
 from utils.database import Database
+from utils.cache import cached
+from utils.table_query import build_page_query, diff_rows
+from utils.aggregates import horse_sex_counts
+from utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+px = lazy_import("plotly.express")
 
 
 dash.register_page(__name__, path='/stable')
@@ -14,52 +21,129 @@ _id = lambda x: f"{APP_NAME}-{x}"
 
 db = Database()
 
-def get_horses(tracks=None):
-    params = {}
-    sql = """SELECT horse_id, horse_name, foaling_date, sex FROM tvg.horses"""
-    if tracks:
-        sql += " WHERE track_id=ANY(%(tracks)s)"
-        params['tracks'] = tracks
-    data = db.query(sql, params, as_df=False)
-        
-    return data
-
-horses = get_horses()
+@cached(ttl=30, stale_ttl=120)
+def get_horses_page(page_current=0, page_size=50, sort_by=None, filter_query=None):
+    """one page of horses plus the total matching row count"""
+    query, count, params = build_page_query('tvg.horses', cols, page_current, page_size, sort_by, filter_query,
+                                            default_sort=[{'column_id': 'horse_id', 'direction': 'asc'}])
+    rows = db.query(query, params, as_df=False)
+    n = db.query(count, params, as_df=False)[0]['n']
+    return rows, n
+
+@cached(ttl=300, stale_ttl=600)
+def get_sex_counts():
+    """{sex: count} from the trigger maintained summary table, invalidated after edits"""
+    return Counter({d['sex']: d['count'] for d in horse_sex_counts(db)})
+
+def sex_pie(counts):
+    df = pd.DataFrame([{'sex': k, 'count': v} for k, v in counts.items() if v > 0], 
+                      columns=['sex', 'count'])
+    return px.pie(df, values='count', names='sex', title='Gender Breakdown')
+
 cols = ["horse_id", "horse_name", "foaling_date", "sex"]
 # cols = db.get_cols('horses')
+page_size = 50
 
 horse_table_id = _id('horses')
 sex_pie_chart_id = _id('sex-pie-chart')
 add_horse_id = _id("add-horse")
 
-cnts = pd.DataFrame(horses).sex.value_counts().to_frame().reset_index(drop=False)
+horse_tabs_id = _id('tabs')
+horse_detail_id = _id('horse-detail')
+horse_url_id = _id('horse-url')
+
+@cached(ttl=300, maxsize=1024)
+def get_horse(horse_id):
+    """one horse's detail record, LRU cached per horse_id"""
+    data = db.query("SELECT * FROM tvg.horses WHERE horse_id = %(horse_id)s", {'horse_id': horse_id}, as_df=False)
+    return data[0] if data else None
+
+def horse_detail(horse_id):
+    if horse_id is None:
+        return html.Div("Select a horse in the Stable tab", style={"margin": "15px 20%"})
+    h = get_horse(horse_id)
+    if h is None:
+        return html.Div(f"Horse {horse_id} not found", style={"margin": "15px 20%"})
+    # just dump out the horse dict
+    return html.Div(pprint.pformat(h, indent=4), style={"white-space": "pre-wrap", "margin": "15px 20%"})
 
 # tabs
-layout = html.Div([
-    dcc.Tabs([
-        dcc.Tab(label='Stable', children=[
-                html.Div(children=[
-                    html.Div([dbc.Button("Primary", color="primary", className="me-1", id=add_horse_id, style={'maxWidth': 100}),], className='row'),
-                    html.Div(dash_table.DataTable(horses,
-                                            [{"name": c, "id": c} for c in cols], 
-                                            editable=True,
-                                            id=horse_table_id),
-                                className="table table-striped table-hover"),
-                    dcc.Graph(figure=px.pie(cnts, values='count', names='sex', title='Gender Breakdown'), id=sex_pie_chart_id)
-    ])])] + [
-        dcc.Tab(label=h['horse_name'], children=[
-            # just dump out the horse dict
-            html.Div(pprint.pformat(h, indent=4), style={"white-space": "pre-wrap", "margin": "15px 20%"})
-        ]) for h in horses])
-])
+def layout(horse_id=None, **kwargs):
+    # called per page load so nothing hits the db at import, /stable?horse_id=123 opens that horse.
+    # the horse tab is a single detail panel filled by a callback, so page weight doesn't grow with the stable
+    return html.Div([
+        dcc.Store(id=horse_url_id, data=horse_id),
+        dcc.Tabs(id=horse_tabs_id, value='horse' if horse_id else 'stable', children=[
+            dcc.Tab(label='Stable', value='stable', children=[
+                    html.Div(children=[
+                        html.Div([dbc.Button("Primary", color="primary", className="me-1", id=add_horse_id, style={'maxWidth': 100}),], className='row'),
+                        html.Div(dash_table.DataTable(columns=[{"name": c, "id": c} for c in cols], 
+                                                editable=True,
+                                                row_deletable=True,
+                                                row_selectable='single',
+                                                selected_rows=[],
+                                                page_current=0,
+                                                page_size=page_size,
+                                                page_action='custom',
+                                                sort_action='custom',
+                                                sort_mode='multi',
+                                                sort_by=[],
+                                                filter_action='custom',
+                                                filter_query='',
+                                                id=horse_table_id),
+                                    className="table table-striped table-hover"),
+                        dcc.Graph(figure=sex_pie(get_sex_counts()), id=sex_pie_chart_id)
+            ])]),
+            dcc.Tab(label='Horse', value='horse', children=[html.Div(id=horse_detail_id)]),
+        ])
+    ])
     
 
+@callback(
+    Output(horse_detail_id, 'children'),
+    Output(horse_tabs_id, 'value'),
+    Input(horse_table_id, 'selected_rows'),
+    Input(horse_url_id, 'data'),
+    State(horse_table_id, 'data'))
+def display_horse(selected_rows, url_horse_id, rows):
+    if ctx.triggered_id == horse_table_id and selected_rows and rows:
+        return horse_detail(rows[selected_rows[0]]['horse_id']), 'horse'
+    if url_horse_id is not None:
+        return horse_detail(url_horse_id), dash.no_update
+    return horse_detail(None), dash.no_update
+
+
+@callback(
+    Output(horse_table_id, 'data'),
+    Output(horse_table_id, 'page_count'),
+    Input(horse_table_id, 'page_current'),
+    Input(horse_table_id, 'page_size'),
+    Input(horse_table_id, 'sort_by'),
+    Input(horse_table_id, 'filter_query'))
+def update_horses_table(page_current, page_size, sort_by, filter_query):
+    rows, n = get_horses_page(page_current, page_size, sort_by, filter_query)
+    return rows, max(1, -(-n // page_size))
+
+
 @callback(
     Output(sex_pie_chart_id, 'figure'),
-    Input(horse_table_id, 'data'),
-    Input(horse_table_id, 'columns'))
-def display_output(rows, columns):
-    df = pd.DataFrame(rows, columns=[c['name'] for c in columns])
-    db.upsert_df(df,  'tvg.horses')
-    df = df.sex.value_counts().to_frame().reset_index(drop=False)
-    return px.pie(df, values='count', names='sex', title='Gender Breakdown')
\ No newline at end of file
+    Input(horse_table_id, 'data_timestamp'),
+    State(horse_table_id, 'data'),
+    State(horse_table_id, 'data_previous'),
+    prevent_initial_call=True)
+def display_output(ts, rows, previous):
+    # data_timestamp only changes on user edits, not when a page is loaded
+    if previous is None:
+        raise PreventUpdate
+    changed, deleted = diff_rows(previous, rows, 'horse_id')
+    if not changed and not deleted:
+        raise PreventUpdate
+    
+    db.write_delta(pd.DataFrame(changed, columns=cols), 'tvg.horses', 
+                   delete_keys=[r['horse_id'] for r in deleted], pkeys=['horse_id'])
+    # the write's triggers already updated tvg.horse_sex_counts
+    get_sex_counts.invalidate()
+    get_horses_page.invalidate()
+    for r in changed + deleted:
+        get_horse.invalidate(r.get('horse_id'))
+    return sex_pie(get_sex_counts())
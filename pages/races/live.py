@@ -0,0 +1,72 @@
+import dash, dash_table
+from dash import html, dcc, Input, Output, State, callback, clientside_callback, Patch
+from dash.exceptions import PreventUpdate
+from utils.live import get_board
+
+# live board of the open races, updated by push from the ETL instead of reloading the page
+dash.register_page(__name__, path='/live', name='Live')
+
+APP_NAME = 'live'
+_id = lambda x: f"{APP_NAME}-{x}"
+
+cols = ["mtp", "track_id", "race_number", "post_time", "distance", "num_runners", "surface", "race_class", "race_id"]
+
+live_table_id = _id('races')
+rows_store_id = _id('rows')
+version_store_id = _id('version')
+poll_id = _id('poll')
+tick_id = _id('tick')
+
+def layout():
+    version, rows = get_board().snapshot()
+    return html.Div(children=[
+        html.H1(children='Live board'),
+        dcc.Store(id=rows_store_id, data=rows),
+        dcc.Store(id=version_store_id, data=version),
+        # version check against the in-process board, no db work per client
+        dcc.Interval(id=poll_id, interval=5_000),
+        # mtp countdown is recomputed in the browser
+        dcc.Interval(id=tick_id, interval=1_000),
+        dash_table.DataTable(columns=[{"name": c, "id": c} for c in cols],
+                             sort_action='native',
+                             filter_action='native',
+                             page_size=50,
+                             id=live_table_id),
+    ])
+
+
+@callback(
+    Output(rows_store_id, 'data'),
+    Output(version_store_id, 'data'),
+    Input(poll_id, 'n_intervals'),
+    State(version_store_id, 'data'),
+    prevent_initial_call=True)
+def poll_board(n, version):
+    board = get_board()
+    current, changes = board.changes_since(version)
+    if current == version:
+        raise PreventUpdate
+    if changes is None:
+        return board.snapshot()
+    # send only the changed races, merged into the browser's copy
+    patch = Patch()
+    for race_id, row in changes.items():
+        if row is None:
+            del patch[race_id]
+        else:
+            patch[race_id] = row
+    return patch, current
+
+
+clientside_callback(
+    """
+    function(n, rows) {
+        const now = Date.now();
+        return Object.values(rows || {})
+            .map(r => Object.assign({}, r, {mtp: r.post_time ? Math.round((Date.parse(r.post_time) - now) / 60000) : null}))
+            .sort((a, b) => (a.mtp === null) - (b.mtp === null) || a.mtp - b.mtp);
+    }
+    """,
+    Output(live_table_id, 'data'),
+    Input(tick_id, 'n_intervals'),
+    Input(rows_store_id, 'data'))
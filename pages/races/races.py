@@ -1,31 +1,119 @@
 import dash, dash_table
-import pandas as pd
-from dash import html, dcc
+from dash import html, dcc, Input, Output, callback
 from utils.database import Database
+from utils.lazy import lazy_import
+from utils.cache import cached
+from utils.table_query import build_page_query
+from utils import aggregates
 import dash_bootstrap_components as dbc
 
+px = lazy_import("plotly.express")
+
 # this registers that page that's accessible on 
 dash.register_page(__name__, path='/races')
 
+APP_NAME = 'races'
+_id = lambda x: f"{APP_NAME}-{x}"
+
 db = Database()
 
-def get_races(tracks=None):
-    params = {}
-    sql = """SELECT * FROM tvg.races"""
+cols = ["race_id", "track_id", "race_date", "post_time", "race_number", "distance", "surface", "race_class"]
+# newest first, race_id last so offset paging is deterministic
+default_sort = [{'column_id': 'race_date', 'direction': 'desc'}, 
+                {'column_id': 'post_time', 'direction': 'asc'}, 
+                {'column_id': 'race_id', 'direction': 'asc'}]
+page_size = 50
+
+race_table_id = _id('races')
+track_filter_id = _id('track-filter')
+date_filter_id = _id('date-filter')
+track_day_chart_id = _id('track-day-chart')
+surface_chart_id = _id('surface-chart')
+distance_chart_id = _id('distance-chart')
+
+@cached(ttl=300, stale_ttl=600)
+def get_tracks():
+    return db.execute("SELECT DISTINCT track_id FROM tvg.races ORDER BY track_id", flatten=True)
+
+@cached(ttl=30, stale_ttl=120)
+def get_races_page(page_current=0, page_size=page_size, sort_by=None, filter_query=None, 
+                   tracks=None, start_date=None, end_date=None):
+    """one page of races plus the total matching row count"""
+    where, params = [], {}
     if tracks:
-        sql += " WHERE track_id=ANY(%(tracks)s)"
+        where.append("track_id=ANY(%(tracks)s)")
         params['tracks'] = tracks
-    data = db.query(sql, params, as_df=False)
-        
-    return pd.DataFrame(data)
+    if start_date:
+        where.append("race_date >= %(start_date)s")
+        params['start_date'] = start_date
+    if end_date:
+        where.append("race_date <= %(end_date)s")
+        params['end_date'] = end_date
+    query, count, params = build_page_query('tvg.races', cols, page_current, page_size, sort_by, filter_query,
+                                            where=where, params=params, default_sort=default_sort)
+    rows = db.query(query, params, as_df=False)
+    n = db.query(count, params, as_df=False)[0]['n']
+    return rows, n
 
-races = get_races()
-cols = db.get_cols('races')
+@cached(ttl=60, stale_ttl=300)
+def get_race_charts(tracks=None, start_date=None, end_date=None):
+    """chart figures from the race_daily_summary table, never the races table"""
+    by_day = aggregates.races_per_track_day(db, tracks, start_date, end_date)
+    surfaces = aggregates.surface_mix(db, tracks, start_date, end_date)
+    distances = aggregates.distance_distribution(db, tracks, start_date, end_date)
+    return (px.bar(by_day, x='race_date', y='races', color='track_id', title='Races per track per day') if len(by_day) else {},
+            px.pie(surfaces, values='races', names='surface', title='Surface mix') if len(surfaces) else {},
+            px.bar(distances, x='distance', y='races', title='Distances') if len(distances) else {})
 
-layout = html.Div(children=[
-    html.H1(children='Races for today'),
-
-    html.Div(children=[
-        dbc.Table.from_dataframe(races, striped=True, bordered=True, hover=True)
+def layout():
+    # called per page load so nothing hits the db at import
+    return html.Div(children=[
+        html.H1(children='Races for today'),
+        dbc.Row([
+            dbc.Col(dcc.Dropdown(options=get_tracks(), multi=True, placeholder="Tracks", id=track_filter_id)),
+            dbc.Col(dcc.DatePickerRange(id=date_filter_id, clearable=True)),
+        ], className="my-2"),
+        html.Div(children=[
+            dash_table.DataTable(columns=[{"name": c, "id": c} for c in cols],
+                                 page_current=0,
+                                 page_size=page_size,
+                                 page_action='custom',
+                                 sort_action='custom',
+                                 sort_mode='multi',
+                                 sort_by=[],
+                                 filter_action='custom',
+                                 filter_query='',
+                                 id=race_table_id)
+            ]),
+        dbc.Row([
+            dbc.Col(dcc.Graph(id=track_day_chart_id), width=12),
+            dbc.Col(dcc.Graph(id=surface_chart_id), width=6),
+            dbc.Col(dcc.Graph(id=distance_chart_id), width=6),
         ]),
-])
\ No newline at end of file
+    ])
+
+
+@callback(
+    Output(race_table_id, 'data'),
+    Output(race_table_id, 'page_count'),
+    Input(race_table_id, 'page_current'),
+    Input(race_table_id, 'page_size'),
+    Input(race_table_id, 'sort_by'),
+    Input(race_table_id, 'filter_query'),
+    Input(track_filter_id, 'value'),
+    Input(date_filter_id, 'start_date'),
+    Input(date_filter_id, 'end_date'))
+def update_races_table(page_current, page_size, sort_by, filter_query, tracks, start_date, end_date):
+    rows, n = get_races_page(page_current, page_size, sort_by, filter_query, tracks, start_date, end_date)
+    return rows, max(1, -(-n // page_size))
+
+
+@callback(
+    Output(track_day_chart_id, 'figure'),
+    Output(surface_chart_id, 'figure'),
+    Output(distance_chart_id, 'figure'),
+    Input(track_filter_id, 'value'),
+    Input(date_filter_id, 'start_date'),
+    Input(date_filter_id, 'end_date'))
+def update_race_charts(tracks, start_date, end_date):
+    return get_race_charts(tracks, start_date, end_date)
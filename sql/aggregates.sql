@@ -0,0 +1,59 @@
+-- summary tables/views the dashboard charts read instead of scanning the base tables
+
+-- races per day / track / surface / distance, every race chart is a small GROUP BY over this.
+-- kept up to date by the schedule ETL which recomputes only the race_dates it wrote (utils.aggregates)
+CREATE TABLE race_daily_summary(
+    race_date DATE NOT NULL,
+    track_id TEXT NOT NULL,
+    surface TEXT NOT NULL,
+    distance TEXT NOT NULL,
+    races INT NOT NULL,
+    PRIMARY KEY (race_date, track_id, surface, distance)
+);
+
+INSERT INTO race_daily_summary
+SELECT race_date, track_id, COALESCE(surface, 'unknown'), distance, count(*)
+FROM races
+GROUP BY 1, 2, 3, 4;
+
+-- horses by sex for the stable pie chart. Statement level triggers on horses apply each write's delta
+-- in the same transaction, so an edit costs O(rows changed) instead of a full recount
+CREATE TABLE horse_sex_counts(
+    sex TEXT PRIMARY KEY,
+    count INT NOT NULL
+);
+
+INSERT INTO horse_sex_counts
+SELECT COALESCE(sex, 'unknown'), count(*)
+FROM horses
+GROUP BY 1;
+
+-- (sex, +1/-1) rows from the transition tables, summed into the counts
+CREATE FUNCTION horse_sex_counts_apply_delta() RETURNS trigger LANGUAGE plpgsql SET search_path FROM CURRENT AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO horse_sex_counts AS c
+        SELECT COALESCE(sex, 'unknown'), count(*) FROM new_rows GROUP BY 1
+        ON CONFLICT (sex) DO UPDATE SET count = c.count + excluded.count;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE horse_sex_counts c SET count = c.count - d.n
+        FROM (SELECT COALESCE(sex, 'unknown') AS sex, count(*) AS n FROM old_rows GROUP BY 1) d
+        WHERE c.sex = d.sex;
+    ELSE
+        INSERT INTO horse_sex_counts AS c
+        SELECT sex, sum(n) FROM (
+            SELECT COALESCE(sex, 'unknown') AS sex, 1 AS n FROM new_rows
+            UNION ALL
+            SELECT COALESCE(sex, 'unknown'), -1 FROM old_rows) d
+        GROUP BY 1 HAVING sum(n) <> 0
+        ON CONFLICT (sex) DO UPDATE SET count = c.count + excluded.count;
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER horse_sex_counts_insert AFTER INSERT ON horses
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION horse_sex_counts_apply_delta();
+CREATE TRIGGER horse_sex_counts_delete AFTER DELETE ON horses
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION horse_sex_counts_apply_delta();
+CREATE TRIGGER horse_sex_counts_update AFTER UPDATE ON horses
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION horse_sex_counts_apply_delta();
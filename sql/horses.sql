@@ -0,0 +1,8 @@
+CREATE TABLE horses(
+    horse_id INT PRIMARY KEY,
+    horse_name TEXT NOT NULL,
+    foaling_date DATE,
+    sex TEXT,
+    track_id TEXT
+);
+CREATE INDEX horse_track_idx ON horses (track_id);
@@ -1,4 +1,5 @@
-CREATE TABLE races(
+-- safe to re-run on an existing database, columns added after the first release are ALTERed in below
+CREATE TABLE IF NOT EXISTS races(
     race_id TEXT PRIMARY KEY,
     track_id TEXT NOT NULL,
     race_date DATE NOT NULL,
@@ -8,5 +9,23 @@ CREATE TABLE races(
     surface TEXT,
     race_class TEXT
 );
-CREATE INDEX race_date_idx ON races (race_date);
-CREATE INDEX track_idx ON races (track_id);
+CREATE INDEX IF NOT EXISTS race_date_idx ON races (race_date);
+CREATE INDEX IF NOT EXISTS track_idx ON races (track_id);
+
+ALTER TABLE races ADD COLUMN IF NOT EXISTS num_runners INT;
+
+-- fingerprint of the last parsed schedule record per race so the ETL only writes new/changed races
+-- removed_at is set when a race drops out of the open schedule.
+-- all three times are naive UTC, the ETL sets them from its poll's capture time
+CREATE TABLE IF NOT EXISTS race_schedule(
+    race_id TEXT PRIMARY KEY REFERENCES races (race_id) ON DELETE CASCADE,
+    fingerprint TEXT NOT NULL,
+    first_seen TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
+    changed_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
+    removed_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS race_schedule_active_idx ON race_schedule (race_id) WHERE removed_at IS NULL;
+
+-- live board version, bumped with every races_changed NOTIFY (utils.live.notify_races) so every app
+-- process numbers board changes the same way
+CREATE SEQUENCE IF NOT EXISTS race_board_version;
@@ -0,0 +1,15 @@
+-- append-only history of the polled schedule state (mtp, runners, post time drift) per race.
+-- the ETL appends one row per race on every poll, utils.snapshots reads, downsamples and prunes it.
+-- captured_at is UTC like post_time, BRIN keeps the capture time index tiny since rows arrive in time order
+CREATE TABLE race_snapshots(
+    captured_at TIMESTAMP NOT NULL,
+    race_id TEXT NOT NULL,
+    track_id TEXT NOT NULL,
+    race_date DATE NOT NULL,
+    post_time TIMESTAMP,
+    mtp INT,
+    num_runners INT
+);
+CREATE INDEX race_snapshots_captured_brin ON race_snapshots USING BRIN (captured_at);
+-- as of / history lookups for one race
+CREATE INDEX race_snapshots_race_idx ON race_snapshots (race_id, captured_at);
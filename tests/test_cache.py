@@ -0,0 +1,108 @@
+import time
+import threading
+
+import pytest
+
+from utils.cache import TTLCache, SharedCache, cached, make_key
+
+
+def test_make_key_freezes_unhashable_args():
+    key = make_key(["USA_BEL"], sort_by=[{'column_id': 'post_time'}], tracks={"b", "a"})
+    assert hash(key) == hash(make_key(["USA_BEL"], tracks={"a", "b"}, sort_by=[{'column_id': 'post_time'}]))
+
+
+def test_single_flight():
+    """concurrent misses for one key run the loader once and all get its value"""
+    cache = TTLCache(ttl=60)
+    release, calls = threading.Event(), []
+    
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return "races"
+    
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("k", loader))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    # let every thread reach get() before the load finishes
+    deadline = time.monotonic() + 5
+    while cache.stats['misses'] < len(threads) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert results == ["races"] * len(threads)
+    assert len(calls) == 1
+    assert cache.stats['loads'] == 1
+
+
+def test_single_flight_error_reaches_every_waiter_and_isnt_cached():
+    cache = TTLCache(ttl=60)
+    
+    def fail():
+        raise ValueError("db down")
+    
+    with pytest.raises(ValueError):
+        cache.get("k", fail)
+    assert cache.get("k", lambda: 1) == 1
+    assert cache.stats['errors'] == 1
+
+
+def test_ttl_and_stale_while_revalidate():
+    cache = TTLCache(ttl=0.05, stale_ttl=60)
+    assert cache.get("k", lambda: 1) == 1
+    time.sleep(0.06)
+    refreshed = threading.Event()
+    
+    def reload():
+        refreshed.set()
+        return 2
+    
+    # stale value served straight away, refreshed in the background
+    assert cache.get("k", reload) == 1
+    assert refreshed.wait(5)
+    deadline = time.monotonic() + 5
+    while cache.get("k", reload) != 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get("k", reload) == 2
+
+
+def test_maxsize_and_invalidate():
+    cache = TTLCache(ttl=60, maxsize=2)
+    for k in "abc":
+        cache.get(k, lambda: k)
+    assert list(cache._data) == ["b", "c"]
+    cache.invalidate("b")
+    assert list(cache._data) == ["c"]
+    cache.invalidate()
+    assert not cache._data
+
+
+def test_shared_cache_caches_none(tmp_path):
+    shared = SharedCache(str(tmp_path / "cache.sqlite"))
+    calls = []
+    
+    def loader():
+        calls.append(1)
+        return None
+    
+    assert shared.load("ns", 0, ("k",), loader, ttl=60) is None
+    assert shared.load("ns", 0, ("k",), loader, ttl=60) is None
+    assert len(calls) == 1
+
+
+def test_cached_invalidate_with_shared_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.cache._shared", SharedCache(str(tmp_path / "cache.sqlite")))
+    monkeypatch.setenv("CACHE_DIR", str(tmp_path))
+    calls = []
+    
+    @cached(ttl=60)
+    def get_races(track):
+        calls.append(track)
+        return len(calls)
+    
+    assert get_races("USA_BEL") == 1
+    assert get_races("USA_BEL") == 1
+    get_races.invalidate("USA_BEL")
+    assert get_races("USA_BEL") == 2
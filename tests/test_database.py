@@ -0,0 +1,39 @@
+import pytest
+
+from utils.database import Database
+
+# (race_id, distance, surface), race_id is the key
+ROWS = [("a", "6f", None), ("b", "1m", "dirt"), ("a", None, "turf"), ("a", "7f", None)]
+
+
+@pytest.mark.parametrize("mode, expected", [
+    ("overwrite", [("a", "7f", None), ("b", "1m", "dirt")]),
+    # each column's last non-null value, like COALESCE(excluded, stored) applied row by row
+    ("except_null", [("a", "7f", "turf"), ("b", "1m", "dirt")]),
+    # each column's first non-null value, like COALESCE(stored, excluded) applied row by row
+    ("only_null", [("a", "6f", "turf"), ("b", "1m", "dirt")]),
+])
+def test_merge_duplicates(mode, expected):
+    assert [tuple(r) for r in Database._merge_duplicates(ROWS, [0], mode)] == expected
+
+
+def test_merge_duplicates_without_repeats_returns_rows():
+    rows = [("a", 1), ("b", 2)]
+    assert Database._merge_duplicates(rows, [0], "except_null") is rows
+
+
+def test_merge_duplicates_composite_key():
+    rows = [("a", 1, None), ("a", 2, "x"), ("a", 1, "y")]
+    assert [tuple(r) for r in Database._merge_duplicates(rows, [0, 1], "except_null")] == [("a", 1, "y"), ("a", 2, "x")]
+
+
+def test_lock_order_puts_nulls_last():
+    assert Database._lock_order([("b",), (None,), ("a",)], [0]) == [("a",), ("b",), (None,)]
+
+
+def test_pools_are_keyed_by_pool_params():
+    assert Database()._pool_id == Database()._pool_id
+    assert Database(max_size=2)._pool_id != Database(max_size=3)._pool_id
+    assert Database(timeout=5)._pool_id != Database(timeout=30)._pool_id
+    # the metadata cache is still shared across pool sizes
+    assert Database(max_size=2)._pool_key == Database(max_size=3)._pool_key
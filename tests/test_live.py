@@ -0,0 +1,72 @@
+from utils.live import RaceBoard, BOARD_VERSION_SQL
+
+
+class FakeDB:
+    """answers RaceBoard's two queries from a dict of open races"""
+    
+    def __init__(self, version=0, rows=None):
+        self.version = version
+        self.rows = rows or {}
+    
+    def query(self, query, params=None, as_df=True):
+        if query == BOARD_VERSION_SQL:
+            return [{'version': self.version}]
+        ids = params['race_ids'] if params else list(self.rows)
+        return [dict(self.rows[i]) for i in ids if i in self.rows]
+
+
+def race(race_id, num_runners=8):
+    return {'race_id': race_id, 'track_id': "USA_BEL", 'race_date': None, 'post_time': None, 
+            'num_runners': num_runners}
+
+
+def make_board(max_log=1000):
+    db = FakeDB(version=5, rows={"a": race("a"), "b": race("b")})
+    board = RaceBoard(db=db, max_log=max_log)
+    board.reload()
+    return board, db
+
+
+def test_changes_since_current_version_is_empty():
+    board, _ = make_board()
+    assert board.changes_since(5) == (5, {})
+
+
+def test_changes_since_none_or_too_old_needs_a_snapshot():
+    board, db = make_board()
+    assert board.changes_since(None) == (5, None)
+    assert board.changes_since(4) == (5, None)
+
+
+def test_changes_since_merges_logged_changes():
+    board, db = make_board()
+    db.rows["a"] = race("a", num_runners=7)
+    board.apply(6, ["a"])
+    del db.rows["b"]
+    db.rows["c"] = race("c")
+    board.apply(7, ["b", "c"])
+    version, changes = board.changes_since(5)
+    assert version == 7
+    assert changes == {"a": race("a", num_runners=7), "b": None, "c": race("c")}
+    assert board.changes_since(6) == (7, {"b": None, "c": race("c")})
+
+
+def test_changes_since_client_ahead_of_this_process():
+    board, _ = make_board()
+    assert board.changes_since(9) == (9, {})
+
+
+def test_changes_since_past_the_bounded_log():
+    board, db = make_board(max_log=2)
+    board.apply(6, ["a"])
+    board.apply(7, ["a"])
+    # the reload marker (version 5) has been pushed out, version 5 clients can't be caught up
+    assert board.changes_since(5) == (7, None)
+    assert board.changes_since(6) == (7, {"a": race("a")})
+
+
+def test_stale_notify_does_not_move_the_version_back():
+    board, _ = make_board()
+    board.apply(3, ["a"])
+    assert board.version == 5
+    assert board.changes_since(5) == (5, {})
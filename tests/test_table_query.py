@@ -0,0 +1,94 @@
+import pytest
+
+from utils.table_query import split_filter_part, build_filters, build_page_query, diff_rows
+
+
+def render(q):
+    return q.as_string(None)
+
+
+@pytest.mark.parametrize("part, expected", [
+    ("{race_number} ge 3", ('race_number', 'ge ', '3')),
+    ("{race_number} >= 3", ('race_number', 'ge ', '3')),
+    ("{race_number} le 3", ('race_number', 'le ', '3')),
+    ("{race_number} <= 3", ('race_number', 'le ', '3')),
+    ("{race_number} lt 3", ('race_number', 'lt ', '3')),
+    ("{race_number} < 3", ('race_number', 'lt ', '3')),
+    ("{race_number} gt 3", ('race_number', 'gt ', '3')),
+    ("{race_number} > 3", ('race_number', 'gt ', '3')),
+    ("{race_number} ne 3", ('race_number', 'ne ', '3')),
+    ("{race_number} != 3", ('race_number', 'ne ', '3')),
+    ("{race_number} eq 3", ('race_number', 'eq ', '3')),
+    ("{race_number} = 3", ('race_number', 'eq ', '3')),
+    ("{track_id} contains bel", ('track_id', 'contains ', 'bel')),
+    ("{race_date} datestartswith 2024-01", ('race_date', 'datestartswith ', '2024-01')),
+])
+def test_split_filter_part_operators(part, expected):
+    assert split_filter_part(part) == expected
+
+
+@pytest.mark.parametrize("part, value", [
+    ('{race_class} contains "maiden claiming"', "maiden claiming"),
+    ("{race_class} contains 'maiden claiming'", "maiden claiming"),
+    ("{race_class} contains `maiden claiming`", "maiden claiming"),
+    ('{horse_name} eq "Say \\"Hi\\""', 'Say "Hi"'),
+    # operator-like text in the value isn't split on
+    ("{race_class} contains Lone Star eq 3", "Lone Star eq 3"),
+    ('{race_class} eq "a >= b"', "a >= b"),
+])
+def test_split_filter_part_values(part, value):
+    assert split_filter_part(part)[2] == value
+
+
+@pytest.mark.parametrize("part", ["", "race_number ge 3", "{race_number", "}race_number{ ge 3",
+                                  "{race_number} between 3", "{race_number}"])
+def test_split_filter_part_malformed(part):
+    assert split_filter_part(part) == (None, None, None)
+
+
+def test_build_filters():
+    conditions, params = build_filters("{track_id} contains bel && {race_number} >= 3 && {race_date} datestartswith 2024", 
+                                       ['track_id', 'race_number', 'race_date'])
+    assert [render(c) for c in conditions] == ['"track_id"::text ILIKE %(_f0)s', '"race_number" >= %(_f1)s',
+                                              '"race_date"::text LIKE %(_f2)s']
+    assert params == {'_f0': "%bel%", '_f1': "3", '_f2': "2024%"}
+
+
+def test_build_filters_skips_unknown_columns_and_empty_values():
+    conditions, params = build_filters("{nope} eq 1 && {track_id} eq \"\" && garbage", ['track_id'])
+    assert conditions == [] and params == {}
+
+
+def test_build_page_query_limit_offset():
+    query, count, params = build_page_query("tvg.races", ['race_id', 'track_id'], page_current=3, page_size=25)
+    assert render(query) == ('SELECT "race_id", "track_id" FROM "tvg"."races" '
+                             'LIMIT %(_limit)s OFFSET %(_offset)s')
+    assert render(count) == 'SELECT count(*) AS n FROM "tvg"."races"'
+    assert params['_limit'] == 25 and params['_offset'] == 75
+
+
+def test_build_page_query_sort_where_and_filters():
+    query, count, params = build_page_query(
+        "tvg.races", ['race_id', 'track_id', 'post_time'], page_current=0, page_size=50,
+        sort_by=[{'column_id': 'post_time', 'direction': 'desc'}, {'column_id': 'nope', 'direction': 'asc'}],
+        filter_query="{track_id} eq USA_BEL", where=["race_date >= %(start)s"], params={'start': "2024-01-01"},
+        default_sort=[{'column_id': 'post_time', 'direction': 'asc'}, {'column_id': 'race_id', 'direction': 'asc'}])
+    where = ' WHERE race_date >= %(start)s AND "track_id" = %(_f0)s'
+    assert render(query) == ('SELECT "race_id", "track_id", "post_time" FROM "tvg"."races"' + where +
+                             ' ORDER BY "post_time" DESC NULLS LAST, "race_id" ASC NULLS LAST'
+                             ' LIMIT %(_limit)s OFFSET %(_offset)s')
+    assert render(count) == 'SELECT count(*) AS n FROM "tvg"."races"' + where
+    assert params == {'start': "2024-01-01", '_f0': "USA_BEL", '_limit': 50, '_offset': 0}
+
+
+def test_diff_rows():
+    previous = [{'horse_id': 1, 'sex': 'colt'}, {'horse_id': 2, 'sex': 'mare'}, {'horse_id': 3, 'sex': None}]
+    current = [{'horse_id': 1, 'sex': 'colt'}, {'horse_id': 3, 'sex': 'filly'}, {'horse_id': 4, 'sex': 'mare'}]
+    changed, deleted = diff_rows(previous, current, 'horse_id')
+    assert changed == [{'horse_id': 3, 'sex': 'filly'}, {'horse_id': 4, 'sex': 'mare'}]
+    assert deleted == [{'horse_id': 2, 'sex': 'mare'}]
+
+
+def test_diff_rows_empty():
+    assert diff_rows(None, None, 'horse_id') == ([], [])
+    assert diff_rows([], [{'horse_id': 1}], 'horse_id') == ([{'horse_id': 1}], [])
@@ -0,0 +1,55 @@
+"""refresh + read the summary tables in sql/aggregates.sql, chart callbacks only read these"""
+
+RACE_SUMMARY_DELETE = "DELETE FROM tvg.race_daily_summary WHERE race_date = ANY(%(race_dates)s::date[])"
+RACE_SUMMARY_INSERT = """INSERT INTO tvg.race_daily_summary
+                         SELECT race_date, track_id, COALESCE(surface, 'unknown'), distance, count(*)
+                         FROM tvg.races
+                         WHERE race_date = ANY(%(race_dates)s::date[])
+                         GROUP BY 1, 2, 3, 4"""
+
+
+def refresh_race_summary(db, race_dates):
+    """recompute the summary rows for just race_dates (uses race_date_idx), atomically"""
+    race_dates = sorted({str(d)[:10] for d in race_dates if d})
+    if not race_dates:
+        return
+    with db.transaction() as conn:
+        conn.execute(RACE_SUMMARY_DELETE, {'race_dates': race_dates})
+        conn.execute(RACE_SUMMARY_INSERT, {'race_dates': race_dates})
+
+
+def _race_summary_where(tracks=None, start_date=None, end_date=None):
+    where, params = ["TRUE"], {}
+    if tracks:
+        where.append("track_id=ANY(%(tracks)s)")
+        params['tracks'] = tracks
+    if start_date:
+        where.append("race_date >= %(start_date)s")
+        params['start_date'] = start_date
+    if end_date:
+        where.append("race_date <= %(end_date)s")
+        params['end_date'] = end_date
+    return " AND ".join(where), params
+
+
+def races_per_track_day(db, tracks=None, start_date=None, end_date=None):
+    where, params = _race_summary_where(tracks, start_date, end_date)
+    return db.query(f"""SELECT race_date, track_id, sum(races) AS races FROM tvg.race_daily_summary 
+                        WHERE {where} GROUP BY 1, 2 ORDER BY 1, 2""", params)
+
+
+def surface_mix(db, tracks=None, start_date=None, end_date=None):
+    where, params = _race_summary_where(tracks, start_date, end_date)
+    return db.query(f"""SELECT surface, sum(races) AS races FROM tvg.race_daily_summary 
+                        WHERE {where} GROUP BY 1 ORDER BY 2 DESC""", params)
+
+
+def distance_distribution(db, tracks=None, start_date=None, end_date=None):
+    where, params = _race_summary_where(tracks, start_date, end_date)
+    return db.query(f"""SELECT distance, sum(races) AS races FROM tvg.race_daily_summary 
+                        WHERE {where} GROUP BY 1 ORDER BY 2 DESC""", params)
+
+
+def horse_sex_counts(db):
+    """kept current by triggers on tvg.horses, see sql/aggregates.sql"""
+    return db.query("SELECT sex, count FROM tvg.horse_sex_counts WHERE count > 0", as_df=False)
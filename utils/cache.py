@@ -0,0 +1,224 @@
+import os
+import time
+import pickle
+import random
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+
+_MISS = object()  # SharedCache.get miss, None is a cacheable value
+
+
+def make_key(*args, **kwargs):
+    """hashable cache key from call args, lists/dicts/sets (e.g. query params) are frozen"""
+    def freeze(x):
+        if isinstance(x, dict):
+            return tuple(sorted((k, freeze(v)) for k, v in x.items()))
+        if isinstance(x, (list, tuple)):
+            return tuple(freeze(v) for v in x)
+        if isinstance(x, set):
+            return tuple(sorted(freeze(v) for v in x))
+        return x
+    return (freeze(args), freeze(kwargs))
+
+
+class TTLCache:
+    """thread safe in-process cache with 
+    - ttl: seconds a value is fresh
+    - stale_ttl: seconds past ttl a stale value is still served while it's refreshed
+      in a background thread (stale-while-revalidate), 0 to always load synchronously
+    - single-flight: concurrent misses for the same key wait on one load instead of each running it
+    - maxsize: least recently used keys are evicted past this
+    """
+    
+    def __init__(self, ttl=60, stale_ttl=0, maxsize=256):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (loaded_at, value)
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'loads': 0, 'errors': 0}
+    
+    def get(self, key, loader):
+        """cached value for key, calling loader() to (re)load it"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                age = time.monotonic() - entry[0]
+                if age < self.ttl:
+                    self._data.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry[1]
+                if age < self.ttl + self.stale_ttl:
+                    self._data.move_to_end(key)
+                    self.stats['stale_hits'] += 1
+                    if key not in self._inflight:
+                        self._inflight[key] = Future()
+                        threading.Thread(target=self._load, args=(key, loader), daemon=True).start()
+                    return entry[1]
+            self.stats['misses'] += 1
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if owner:
+            self._load(key, loader)
+        return fut.result()
+    
+    def _load(self, key, loader):
+        fut = self._inflight[key]
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                self.stats['errors'] += 1
+                del self._inflight[key]
+            fut.set_exception(e)
+            return
+        with self._lock:
+            self.stats['loads'] += 1
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            del self._inflight[key]
+        fut.set_result(value)
+    
+    def invalidate(self, key=None):
+        """drop one key or everything, in-flight loads still finish and store their result"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+
+class SharedCache:
+    """cross-process cache in a sqlite file (WAL), so gunicorn workers on one host share loads.
+    Values are pickled with an expiry, each namespace has a generation that invalidate() bumps, 
+    which drops every worker's copies at once since keys include it. Generations are re-read at most 
+    every gen_ttl seconds per process, so a bump reaches other workers within gen_ttl and a cache hit 
+    doesn't cost a sqlite read for the generation"""
+    
+    SCHEMA = ["CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL NOT NULL, value BLOB NOT NULL)",
+              "CREATE TABLE IF NOT EXISTS generations (ns TEXT PRIMARY KEY, gen INTEGER NOT NULL)"]
+    
+    def __init__(self, path, timeout=5, purge_every=500, gen_ttl=1.0):
+        self.path = path
+        self.timeout = timeout
+        self.purge_every = purge_every
+        self.gen_ttl = gen_ttl
+        self._gens = {}  # ns -> (read_at, gen)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for q in self.SCHEMA:
+                conn.execute(q)
+    
+    def _conn(self):
+        # sqlite connections can't be shared across threads, one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    @staticmethod
+    def _key(ns, gen, key):
+        return f"{ns}:{gen}:{hashlib.sha1(repr(key).encode()).hexdigest()}"
+    
+    def generation(self, ns):
+        entry = self._gens.get(ns)
+        if entry is not None and time.monotonic() - entry[0] < self.gen_ttl:
+            return entry[1]
+        row = self._conn().execute("SELECT gen FROM generations WHERE ns = ?", (ns,)).fetchone()
+        gen = row[0] if row else 0
+        self._gens[ns] = (time.monotonic(), gen)
+        return gen
+    
+    def bump(self, ns):
+        self._conn().execute("""INSERT INTO generations VALUES (?, 1) 
+                                ON CONFLICT (ns) DO UPDATE SET gen = gen + 1""", (ns,))
+        # this worker sees its own invalidation straight away
+        self._gens.pop(ns, None)
+    
+    def get(self, key, default=_MISS):
+        """cached value, default (_MISS) when it's missing or expired"""
+        row = self._conn().execute("SELECT value FROM cache WHERE key = ? AND expires > ?", 
+                                   (key, time.time())).fetchone()
+        return pickle.loads(row[0]) if row else default
+    
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", 
+                     (key, time.time() + ttl, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+        if random.randrange(self.purge_every) == 0:
+            conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+    
+    def load(self, ns, gen, key, loader, ttl):
+        """value from the shared cache, else loader() stored for ttl seconds"""
+        k = self._key(ns, gen, key)
+        value = self.get(k)
+        if value is _MISS:
+            value = loader()
+            self.set(k, value, ttl)
+        return value
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def get_shared_cache():
+    """process wide SharedCache in $CACHE_DIR, None (in-process caching only) when it isn't set"""
+    global _shared
+    path = os.getenv("CACHE_DIR")
+    if not path:
+        return None
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                os.makedirs(path, exist_ok=True)
+                _shared = SharedCache(os.path.join(path, "cache.sqlite"))
+    return _shared
+
+
+def cached(ttl=60, stale_ttl=0, maxsize=256):
+    """decorator caching a function's return value per call args in a TTLCache
+    
+        @cached(ttl=60, stale_ttl=300)
+        def get_races(tracks=None): ...
+        
+        get_races.invalidate()  # after writes
+    
+    With $CACHE_DIR set loads go through the SharedCache first, so one worker's load serves the others,
+    and invalidate() reaches every worker (the others within SharedCache.gen_ttl)"""
+    def decorator(func):
+        cache = TTLCache(ttl=ttl, stale_ttl=stale_ttl, maxsize=maxsize)
+        ns = f"{func.__module__}.{func.__qualname__}"
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(*args, **kwargs)
+            shared = get_shared_cache()
+            if shared is None:
+                return cache.get(key, lambda: func(*args, **kwargs))
+            gen = shared.generation(ns)
+            return cache.get((gen, key), lambda: shared.load(ns, gen, key, lambda: func(*args, **kwargs), ttl))
+        
+        def invalidate(*args, **kwargs):
+            shared = get_shared_cache()
+            if shared is not None:
+                # other workers can't be told to drop one key, a new generation drops them all
+                shared.bump(ns)
+                cache.invalidate()
+                return
+            cache.invalidate(make_key(*args, **kwargs) if args or kwargs else None)
+            
+        wrapper.cache = cache
+        wrapper.invalidate = invalidate
+        return wrapper
+    return decorator
@@ -1,12 +1,26 @@
+import io
 import os
 import re
+import asyncio
 import json 
+import time
+import threading
+from contextlib import contextmanager, asynccontextmanager, nullcontext
 import psycopg
 from psycopg import sql
 from psycopg.rows import dict_row
-import pandas as pd
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
 from dotenv import load_dotenv
 
+from utils.instrument import instrumentation as default_instrumentation, QueryEvent, logger
+from utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+# optional, faster multithreaded csv parsing for query_df
+pa = lazy_import("pyarrow", optional=True)
+
 from pathlib import Path
 
 # load .env file with DB Params
@@ -20,7 +34,18 @@ class Database:
     INT_DTYPES = {"integer", "smallint", "bigint", "int"}
     FLOAT_DTYPES = {"numeric", "real", "float", "decimal", "double precision"}
     
-    def __init__(self):
+    # one pool per set of connection + pool params, shared by every Database instance in the process
+    # so pages, callbacks and scheduler jobs all draw from the same connections. An instance asking for
+    # a different size/timeout gets its own pool rather than silently sharing one sized for someone else
+    _pools = {}
+    _pools_lock = threading.Lock()
+    
+    # (pool key, table) -> (expires_at, {'cols', 'dtypes', 'pkeys'})
+    _meta_cache = {}
+    _meta_lock = threading.Lock()
+    
+    def __init__(self, min_size=None, max_size=None, timeout=30, max_idle=600, max_lifetime=3600, meta_ttl=300,
+                 copy_threshold=5000, instrumentation=None):
         self.params = dict(
             dbname=os.getenv("DB_NAME"),
             user=os.getenv("DB_USER"),
@@ -28,134 +53,416 @@ class Database:
             host=os.getenv("DB_URL"),
             autocommit=True,
         )
+        self.pool_params = dict(
+            min_size=int(min_size or os.getenv("DB_POOL_MIN", 1)),
+            max_size=int(max_size or os.getenv("DB_POOL_MAX", 10)),
+            timeout=timeout,
+            max_idle=max_idle,
+            max_lifetime=max_lifetime,
+        )
+        self.meta_ttl = meta_ttl
+        # upserts with at least this many rows go through COPY + staging table instead of executemany
+        self.copy_threshold = copy_threshold
+        # timings/row counts/slow query log for every call, see utils.instrument
+        self.instrumentation = instrumentation or default_instrumentation
         self._execute_check_pattern = re.compile("(?:^update)|(?:^refresh)|(?:(?:(?:create)|(?:drop)|(?:alter)"\
                                                  "|(?:truncate))\s+table)|(?:insert\s+into)|(?:delete from)", flags=re.I)
+        self._ddl_pattern = re.compile(r"(?:create|drop|alter)\s+table\s+(?:if\s+(?:not\s+)?exists\s+)?([\w.\"]+)", flags=re.I)
     
-    def query(self, query, params=None, as_df=True):
-        data = self.execute(query, params, as_dict=True)
-        if as_df:
-            return pd.DataFrame(data)
-        return data
+    @property
+    def _pool_key(self):
+        """connection params, also what the metadata cache is keyed by"""
+        return tuple(sorted((k, str(v)) for k, v in self.params.items()))
+    
+    @property
+    def _pool_id(self):
+        return self._pool_key + tuple(sorted(self.pool_params.items()))
+    
+    @property
+    def pool(self):
+        """shared connection pool for these params, opened lazily on first use"""
+        key = self._pool_id
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._pools_lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    kwargs = self.params.copy()
+                    autocommit = kwargs.pop('autocommit')
+                    pool = ConnectionPool(conninfo=make_conninfo(**kwargs),
+                                          kwargs={'autocommit': autocommit},
+                                          check=ConnectionPool.check_connection,
+                                          name=f"{self.params['dbname']}@{self.params['host']}",
+                                          open=False,
+                                          **self.pool_params)
+                    pool.open()
+                    self._pools[key] = pool
+        return pool
+    
+    @contextmanager
+    def _connection(self, ev=None):
+        """check a connection out of the pool, it's returned (and rolled back if left in a transaction) on exit.
+        Time spent waiting for it is added to ev's connect phase"""
+        start = time.perf_counter()
+        with self.pool.connection() as conn:
+            if ev is not None:
+                ev.timings['connect'] += (time.perf_counter() - start) * 1000
+            yield conn
+    
+    @contextmanager
+    def _instrument(self, op, query=None, params=None):
+        """time a call and record it with self.instrumentation, slow explainable queries get an EXPLAIN plan"""
+        ev = QueryEvent(op, query, params)
+        start = time.perf_counter()
+        try:
+            yield ev
+        except Exception as e:
+            ev.error = repr(e)
+            raise
+        finally:
+            ev.total_ms = (time.perf_counter() - start) * 1000
+            if (ev.error is None and ev.explainable and self.instrumentation.explain_slow 
+                    and self.instrumentation.is_slow(ev)):
+                ev.plan = self._explain(ev.query, ev.params)
+            self.instrumentation.record(ev)
+    
+    def _explain(self, query, params=None):
+        """EXPLAIN (ANALYZE, BUFFERS) in a rolled back transaction so writes aren't applied twice"""
+        try:
+            with self._connection() as conn:
+                with conn.transaction(force_rollback=True):
+                    rows = conn.execute(sql.SQL("EXPLAIN (ANALYZE, BUFFERS) ") + sql.SQL(query), params).fetchall()
+            return "\n".join(r[0] for r in rows)
+        except Exception as e:
+            return f"explain failed: {e!r}"
+    
+    @contextmanager
+    def transaction(self):
+        """pooled connection inside a transaction, committed on exit or rolled back on error
         
+            with db.transaction() as conn:
+                conn.execute(...)
+                conn.execute(...)
+        """
+        with self._connection() as conn:
+            with conn.transaction():
+                yield conn
     
-    def _get_col_dtypes(self, table):
-        params = {}
-        q = """SELECT column_name, data_type 
-               FROM information_schema.columns 
-               WHERE table_name = {table} """
-        if "." in table:
-            q += " AND table_schema = {schema};"
-            schema, table = table.split(".")
-            params['table'] = table
-            params['schema'] = schema
-        else:
-            params['table'] = table
-            
+    @contextmanager
+    def advisory_lock(self, name):
+        """try to take a session level postgres advisory lock keyed by name, yields True if it was acquired.
+        The lock (and the pooled connection holding it) is kept until the block exits, so only one
+        process across every worker/host runs the block at a time
+        
+            with db.advisory_lock("update_scheduled_races") as acquired:
+                if acquired:
+                    ...
+        """
+        with self._connection() as conn:
+            acquired = conn.execute("SELECT pg_try_advisory_lock(hashtext(%s))", [name]).fetchone()[0]
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    conn.execute("SELECT pg_advisory_unlock(hashtext(%s))", [name])
+    
+    def notify(self, channel, ids, chunk_size=200, version_seq=None):
+        """pg_notify channel with a json list of ids, chunked to stay under postgres' 8000 byte payload limit.
+        With version_seq (a sequence name) each payload is {"version": nextval(version_seq), "ids": [...]}, 
+        so every listening process numbers the changes the same way"""
+        ids = list(ids)
+        with self._connection() as conn:
+            for i in range(0, len(ids), chunk_size):
+                chunk = json.dumps(ids[i:i + chunk_size], default=str)
+                if version_seq is None:
+                    conn.execute("SELECT pg_notify(%s, %s)", [channel, chunk])
+                else:
+                    conn.execute("""SELECT pg_notify(%s, json_build_object('version', nextval(%s::regclass), 
+                                                                          'ids', %s::json)::text)""",
+                                 [channel, version_seq, chunk])
+    
+    def listen(self, channel, timeout=None, on_listen=None):
+        """yield (channel, payload) for NOTIFYs on channel from a dedicated (unpooled) connection,
+        since a LISTEN belongs to its session. Stops after timeout seconds without a notify.
+        on_listen() is called once the LISTEN is active, so state loaded there can't miss a notify"""
         with psycopg.connect(**self.params) as conn:
-            with conn.cursor() as cur:
-                q = sql.SQL(q).format(**params)
-                cur.execute(q)
-                return dict(cur.fetchall())
+            conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+            if on_listen is not None:
+                on_listen()
+            for n in conn.notifies(timeout=timeout):
+                yield n.channel, n.payload
     
-    def get_cols(self, table):
-        params = {}
+    def pool_stats(self):
+        """pool metrics (connections_num, requests_num, requests_waiting, requests_wait_ms, 
+        requests_errors (timeouts), pool_size, pool_available, ...)"""
+        stats = self.pool.get_stats()
+        stats['checkouts'] = stats.get('requests_num', 0)
+        stats['waits'] = stats.get('requests_queued', 0)
+        stats['timeouts'] = stats.get('requests_errors', 0)
+        return stats
+    
+    @classmethod
+    def close_pools(cls):
+        """close every shared pool, e.g. at process exit or after a fork"""
+        with cls._pools_lock:
+            for pool in cls._pools.values():
+                pool.close()
+            cls._pools.clear()
+    
+    def query(self, query, params=None, as_df=True, itersize=10000):
+        if as_df:
+            chunks = list(self.stream(query, params, itersize=itersize, as_="df"))
+            if len(chunks) == 1:
+                return chunks[0]
+            return pd.concat(chunks, ignore_index=True)
+        return self.execute(query, params, as_dict=True)
+    
+    def stream(self, query, params=None, itersize=10000, as_="dict"):
+        """run a SELECT on a server-side (named) cursor and yield batches of at most itersize rows
+        as lists of dicts (as_='dict'), lists of tuples (as_='tuple') or DataFrames (as_='df'),
+        so big scans run in bounded memory. The pooled connection is held until the generator
+        is exhausted or closed. as_='df' always yields at least one (possibly empty) frame"""
+        if as_ not in ("dict", "tuple", "df"):
+            raise ValueError(f"unknown stream format {as_}")
+        row_factory = dict_row if as_ == "dict" else None
+        
+        with self._instrument("stream", params=params) as ev, self._connection(ev) as conn:
+            ev.query = query.as_string(conn) if isinstance(query, sql.Composable) else query
+            # named cursors only live inside a transaction
+            with conn.transaction():
+                with conn.cursor(name=f"stream_{threading.get_ident()}_{id(self)}_{time.monotonic_ns()}", 
+                                 row_factory=row_factory) as cur:
+                    cur.itersize = itersize
+                    with ev.phase("execute"):
+                        cur.execute(query if isinstance(query, sql.Composable) else sql.SQL(query), params)
+                    cols = [d.name for d in cur.description or []]
+                    empty = True
+                    while True:
+                        with ev.phase("fetch"):
+                            rows = cur.fetchmany(itersize)
+                        if not rows:
+                            break
+                        empty = False
+                        ev.rows_out += len(rows)
+                        ev.batches += 1
+                        yield pd.DataFrame(rows, columns=cols) if as_ == "df" else rows
+                    if empty and as_ == "df":
+                        yield pd.DataFrame(columns=cols)
 
-        q = """SELECT column_name
-                FROM information_schema.columns 
-                WHERE table_name = {table} """
-        if "." in table:
-            q += " AND table_schema = {schema};"
-            schema, table = table.split(".")
-            params['table'] = table
-            params['schema'] = schema
+    _copy_out_sql = "COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '\\N')"
+    _format_type_sql = "SELECT oid, format_type(oid, NULL) FROM pg_type WHERE oid = ANY(%s)"
+
+    @staticmethod
+    def _render(cur, query, params=None):
+        """query with params bound client side, COPY can't take server side parameters"""
+        return cur.mogrify(query, params).strip().rstrip(";")
+
+    @staticmethod
+    def _describe_query(query):
+        return sql.SQL("SELECT * FROM ({query}) _q LIMIT 0").format(query=sql.SQL(query))
+
+    @classmethod
+    def _read_dtype(cls, dtype):
+        """pandas dtype the CSV reader parses a column of the given db data_type into"""
+        dtype = dtype.lower()
+        if dtype in cls.INT_DTYPES:
+            return "Int64"
+        if dtype in cls.FLOAT_DTYPES:
+            return "float64"
+        return "string"
+
+    @classmethod
+    def _from_copy(cls, s, dtype):
+        """finish typing a column read from COPY csv output, booleans come out as t/f and dates
+        and timestamps as ISO strings. Everything else is already typed by the reader"""
+        dtype = dtype.lower()
+        if dtype == "boolean":
+            return s == "t"
+        if dtype == "date" or dtype.startswith("timestamp"):
+            return pd.to_datetime(s, format="ISO8601", utc=dtype.endswith("with time zone"))
+        return s
+
+    @classmethod
+    def _parse_copy(cls, buf, dtypes):
+        """typed DataFrame from COPY csv output given {col: db data_type}, with pyarrow's reader if installed"""
+        buf.seek(0)
+        read = {c: cls._read_dtype(d) for c, d in dtypes.items()}
+        if pa is not None:
+            from pyarrow import csv as pacsv
+            types = {"Int64": pa.int64(), "float64": pa.float64(), "string": pa.string()}
+            opts = pacsv.ConvertOptions(column_types={c: types[d] for c, d in read.items()},
+                                        null_values=["\\N"], strings_can_be_null=True,
+                                        quoted_strings_can_be_null=False)
+            mapper = {pa.int64(): pd.Int64Dtype(), pa.string(): pd.StringDtype()}.get
+            df = pacsv.read_csv(buf, convert_options=opts).to_pandas(types_mapper=mapper)
         else:
-            params['table'] = table
-            
-        with psycopg.connect(**self.params) as conn:
-            q = sql.SQL(q).format(**params)
-            with conn.cursor() as cur:
-                cur.execute(q)
-                data = cur.fetchall()
-                data = [x[0] for x in data]
-                return data
-                    
-    def get_primary_keys(self, table):
+            df = pd.read_csv(buf, dtype=read, na_values=["\\N"], keep_default_na=False)
+        for c, d in dtypes.items():
+            if c in df:
+                df[c] = cls._from_copy(df[c], d)
+        return df
+
+    def _query_dtypes(self, cur, query, table=None):
+        """{col: db data_type} for a rendered query's output. Columns come from describing the query (LIMIT 0),
+        their types from the table's cached metadata where they match, format_type() for the rest"""
+        cur.execute(self._describe_query(query))
+        cols = [(d.name, d.type_code) for d in cur.description]
+        dtypes = self._get_col_dtypes(table) if table else {}
+        missing = list({oid for c, oid in cols if c not in dtypes})
+        if missing:
+            cur.execute(self._format_type_sql, (missing,))
+            names = dict(cur.fetchall())
+            dtypes.update({c: names[oid] for c, oid in cols if c not in dtypes})
+        return {c: dtypes[c] for c, _ in cols}
+
+    def query_df(self, query, params=None, table=None):
+        """analytic read path for big pulls: COPY (query) TO STDOUT as csv into one buffer, parsed into typed
+        columns (Int64, float64, string, boolean, datetime64) by pandas' C reader or pyarrow's.
+        Much less memory and time than query(as_df=True) for full-history scans. Column dtypes come from
+        _get_col_dtypes(table) when the query reads one table, otherwise from describing the query"""
+        with self._instrument("copy_out", params=params) as ev, self._connection(ev) as conn:
+            with psycopg.ClientCursor(conn) as cur:
+                query = self._render(cur, query, params)
+                ev.query = query
+                with ev.phase("describe"):
+                    dtypes = self._query_dtypes(cur, query, table)
+                buf = io.BytesIO()
+                with ev.phase("copy"), cur.copy(sql.SQL(self._copy_out_sql).format(query=sql.SQL(query))) as copy:
+                    for data in copy:
+                        buf.write(data)
+            with ev.phase("parse"):
+                df = self._parse_copy(buf, dtypes)
+            ev.rows_out = len(df)
+            return df
+
+    def _cached_meta(self, table):
+        hit = self._meta_cache.get((self._pool_key, table))
+        if hit is not None and hit[0] > time.monotonic():
+            return hit[1]
+    
+    @staticmethod
+    def _table_meta_query(table):
         params = {}
         q = """
-        select kc.column_name
-        from information_schema.table_constraints tc
-        join information_schema.key_column_usage kc 
-            on kc.table_name = tc.table_name and kc.table_schema = tc.table_schema and kc.constraint_name = tc.constraint_name
-        where tc.constraint_type = 'PRIMARY KEY'
-        and kc.ordinal_position is not null
-        AND tc.table_name = {table}"""
+        SELECT c.column_name, c.data_type, kc.ordinal_position AS pk_position
+        FROM information_schema.columns c
+        LEFT JOIN information_schema.table_constraints tc
+            ON tc.table_name = c.table_name AND tc.table_schema = c.table_schema AND tc.constraint_type = 'PRIMARY KEY'
+        LEFT JOIN information_schema.key_column_usage kc
+            ON kc.table_name = tc.table_name AND kc.table_schema = tc.table_schema 
+            AND kc.constraint_name = tc.constraint_name AND kc.column_name = c.column_name
+        WHERE c.table_name = {table}"""
         if "." in table:
             params['schema'], params['table'] = table.split(".")
-            q += " AND tc.table_schema = {schema}"
+            q += " AND c.table_schema = {schema}"
         else:
             params['table'] = table
-        
-        with psycopg.connect(**self.params) as conn:
+        q += " ORDER BY c.ordinal_position"
+        return sql.SQL(q).format(**params)
+    
+    def _store_meta(self, table, rows):
+        meta = {'cols': [name for name, _, _ in rows],
+                'dtypes': {name: dtype for name, dtype, _ in rows},
+                'pkeys': [name for name, _, pos in sorted((r for r in rows if r[2] is not None), key=lambda r: r[2])]}
+        with self._meta_lock:
+            self._meta_cache[(self._pool_key, table)] = (time.monotonic() + self.meta_ttl, meta)
+        return meta
+    
+    def get_table_meta(self, table, refresh=False):
+        """column list, dtypes and primary keys for a table, from one catalog query.
+        Cached per table for meta_ttl seconds, shared across instances"""
+        meta = None if refresh else self._cached_meta(table)
+        if meta is not None:
+            return meta
+        with self._instrument("meta", table) as ev, self._connection(ev) as conn:
             with conn.cursor() as cur:
-                q = sql.SQL(q).format(**params)
-                cur.execute(q)
-                return [x[0] for x in cur.fetchall()]
+                with ev.phase("execute"):
+                    cur.execute(self._table_meta_query(table))
+                rows = cur.fetchall()
+                ev.rows_out = len(rows)
+                return self._store_meta(table, rows)
+    
+    @classmethod
+    def invalidate_meta(cls, table=None):
+        """drop cached table metadata, for one table (matched with or without schema) or all tables"""
+        with cls._meta_lock:
+            if table is None:
+                cls._meta_cache.clear()
+                return
+            name = table.split(".")[-1]
+            for key in list(cls._meta_cache):
+                if key[1] == table or key[1].split(".")[-1] == name:
+                    del cls._meta_cache[key]
+    
+    def _get_col_dtypes(self, table):
+        return dict(self.get_table_meta(table)['dtypes'])
+    
+    def get_cols(self, table):
+        return list(self.get_table_meta(table)['cols'])
+                    
+    def get_primary_keys(self, table):
+        return list(self.get_table_meta(table)['pkeys'])
+    
+    TEXT_DTYPES = {"character varying", "text", "character"}
+    JSON_DTYPES = {"json", "jsonb"}
+    
+    @staticmethod
+    def _to_numeric(s):
+        """strip thousands separators from string values ("12,000" -> 12000) and cast to a numeric dtype,
+        "" is treated as null"""
+        if s.dtype == object or pd.api.types.is_string_dtype(s.dtype):
+            s = s.astype("string").str.replace(COMMA_PAT, "", regex=True).replace("", pd.NA)
+        return pd.to_numeric(s)
     
     @classmethod
-    def _prep_col_val(cls, val, dtype, nan_val=None):
-        """clean up the values for database entry"""
+    def _prep_col(cls, s, dtype):
+        """clean up a column for database entry based on the db column's data_type.
+        Values keep a native pandas dtype, they're only boxed in _df_rows at write time"""
         dtype = dtype.lower()
-
-        if pd.isna(val) or val in [cls.NULL, "", None]:
-            val = cls._fill_null(val, dtype=dtype, nan_val=nan_val)
-        elif dtype in cls.FLOAT_DTYPES:
-            if isinstance(val, str):
-                val = COMMA_PAT.sub("", val)
+        if dtype in cls.FLOAT_DTYPES:
+            return cls._to_numeric(s).astype("float64")
         elif dtype in cls.INT_DTYPES:
-            if isinstance(val, str):
-                val = COMMA_PAT.sub("", val)
-            try:
-                v = round(val, 0)
-            except (ValueError, TypeError) as e:
-                v = round(float(val), 0)
-            assert v - round(float(val), 4) == 0, f"CASTING a float as INT for val {val}"
-            val = int(v)
-        elif dtype in ["character varying", "text", "character"]:
-            val = str(val)
-            val = (
-                val.replace("\n", "  ")
-                .replace("\t", "  ")
-                .replace("\r", "  ")
-                .replace(";", "  ")
-                .replace("\.", ".")
-                .replace("\\", "  ")
-                .strip()
-            )
+            s = cls._to_numeric(s)
+            if pd.api.types.is_integer_dtype(s.dtype):
+                return s.astype("Int64")
+            v = s.astype("float64").to_numpy()
+            ok = np.isnan(v) | (np.round(v, 0) - np.round(v, 4) == 0)
+            if not ok.all():
+                raise ValueError(f"CASTING a float as INT for vals {list(s[~ok].head())} in {s.name}")
+            return pd.Series(pd.array(np.round(v, 0), dtype="Float64"), index=s.index, name=s.name).astype("Int64")
+        elif dtype in cls.TEXT_DTYPES:
+            return (s.astype("string")
+                    .str.replace(r"[\n\t\r;]", "  ", regex=True)
+                    .str.replace("\\.", ".", regex=False)
+                    .str.replace("\\", "  ", regex=False)
+                    .str.strip())
         elif dtype == "date":
             # 2020-01-01 00:00:00 -> 2020-01-01
-            if not isinstance(val, str):
-                val = str(val)
-            val = val[:10]
-        return val
-            
+            if pd.api.types.is_datetime64_any_dtype(s.dtype):
+                return s.dt.floor("D")
+            return s.astype("string").str.slice(0, 10).replace("", pd.NA)
+        elif dtype in cls.JSON_DTYPES:
+            ix = s.notnull()
+            out = s.astype(object).where(ix, None)
+            out[ix] = [json.dumps(x, default=str) for x in s[ix]]
+            return out
+        return s
+    
+    @classmethod
+    def _prep_frame(cls, df, dtypes):
+        """prep df cols for insert given {col: db data_type}"""
+        return pd.DataFrame({c: cls._prep_col(df[c], dtypes[c]) if c in dtypes else df[c] for c in df},
+                            index=df.index)
+    
     def _prep_df(self, df, table):
         """prep df cols for insert"""
-        dtypes = self._get_col_dtypes(table)
-        
+        return self._prep_frame(df, self._get_col_dtypes(table))
+    
+    @staticmethod
+    def _df_rows(df):
+        """row values ready for psycopg, nulls (NaN/NA/NaT) as None and numpy scalars as python objects"""
         df = df.astype(object)
-        df = df.where((pd.notnull(df)), None)
-        
-        for c in df:
-            if c not in dtypes:
-                continue
-            dt = dtypes[c]
-            if dt == 'integer':
-                ix = df[c].notnull()
-                df.loc[ix, c] = df[ix][c].astype(int)
-            elif dt in ('json','jsonb'):
-                ix = df[c].notnull()
-                df.loc[ix, c] = df[ix][c].apply(lambda x: json.dumps(x, default=str))
-        return df
+        return df.where(df.notnull(), None).values
     
     @staticmethod
     def _chunk(l, n):
@@ -166,23 +473,33 @@ class Database:
         """Pass params to query as (list or tuples) for %s and
         as a dict for %(param)s for named params in query"""
         
-        db_params = self.params.copy()
-        if as_dict:
-            db_params['row_factory'] = dict_row
-        fetch = self._execute_check_pattern.search(query) is None
+        row_factory = dict_row if as_dict else None
 
-        with psycopg.connect(**db_params) as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql.SQL(query), params)
-                if fetch:
-                    d = cur.fetchall()
+        with self._instrument("execute", params=params) as ev, self._connection(ev) as conn:
+            # composed queries (sql.SQL(...).format(...)) are rendered so the statement checks below work
+            if isinstance(query, sql.Composable):
+                query = query.as_string(conn)
+            ev.query = query
+            ev.explainable = True
+            fetch = self._execute_check_pattern.search(query) is None
+            with conn.cursor(row_factory=row_factory) as cur:
+                with ev.phase("execute"):
+                    cur.execute(sql.SQL(query), params)
+                # statements the pattern doesn't know (CREATE SCHEMA, SET, ...) return no rows either
+                if fetch and cur.description is not None:
+                    with ev.phase("fetch"):
+                        d = cur.fetchall()
+                    ev.rows_out = len(d)
                     if flatten and not as_dict:
                         out = []
                         for x in d:
                             out.extend(x)
                         return out
                     return d
+                ev.rows_in = max(cur.rowcount, 0)
             conn.commit()
+            for table in self._ddl_pattern.findall(query):
+                self.invalidate_meta(table.replace('"', ''))
             return "Success"
     
     def insert_df(self, df, table):
@@ -190,18 +507,19 @@ class Database:
         cols = self._get_df_db_cols(df, table)
         df = self._prep_df(df[cols], table)
         
-        with psycopg.connect(**self.params) as conn:
+        with self._instrument("copy", f"COPY {table} ({', '.join(cols)})") as ev, self._connection(ev) as conn:
             with conn.cursor() as cur:
-                q = sql.SQL("COPY {table} ({cols}) FROM STDIN").format(**{'table': sql.Identifier(table),
+                q = sql.SQL("COPY {table} ({cols}) FROM STDIN").format(**{'table': sql.Identifier(*table.split(".")),
                                                                  "cols": sql.SQL(', ').join(map(sql.Identifier, cols))})
-                with cur.copy(q) as copy:
-                    [copy.write_row(tuple(v)) for v in df[cols].values]
+                with ev.phase("copy"), cur.copy(q) as copy:
+                    for v in self._df_rows(df[cols]):
+                        copy.write_row(tuple(v))
+                        ev.rows_in += 1
                     
-    def _get_df_db_cols(self, df, table):
-        """gets only the columns from the df that are table columns"""
+    @staticmethod
+    def _match_df_cols(df, tbl_cols, table):
         cols = []
         skip_cols = []
-        tbl_cols = self.get_cols(table)
         for c in df:
             if c in tbl_cols:
                 cols.append(c)
@@ -209,141 +527,593 @@ class Database:
                 skip_cols.append(c)
         
         if skip_cols:
-            print(f"_get_df_db_cols: Skipping cols not found in {table}: {','.join(skip_cols)}")
+            logger.info(f"_get_df_db_cols: Skipping cols not found in {table}: {','.join(skip_cols)}")
         return cols
     
-    def _batch_execute(self, query, data, batch_size=10000, table=None):
-        msg = ""
-        with psycopg.connect(**self.params) as conn:
-            with conn.cursor() as cur:
+    def _get_df_db_cols(self, df, table):
+        """gets only the columns from the df that are table columns"""
+        return self._match_df_cols(df, self.get_cols(table), table)
+    
+    @staticmethod
+    def _lock_order(rows, key):
+        """rows sorted by the values at positions key (stable, so duplicate keys keep their order). 
+        Writers that all touch rows in key order take their row locks in the same order and can't deadlock"""
+        return sorted(rows, key=lambda r: tuple((r[i] is None, 0 if r[i] is None else r[i]) for i in key))
+    
+    @staticmethod
+    def _pipeline(conn):
+        """pipeline mode (one round trip per batch of statements) when libpq supports it"""
+        return conn.pipeline() if psycopg.Pipeline.is_supported() else nullcontext()
+    
+    def _batch_execute(self, query, data, batch_size=10000, atomic=True, key=None):
+        """executemany query over data in chunks of batch_size, each chunk pipelined.
+        atomic=True: all chunks in one transaction, all or nothing
+        atomic=False: each chunk commits on its own, a failure leaves the earlier chunks written
+        key: row positions to sort data by first, see _lock_order. Conflicts are handled row by row
+        (ON CONFLICT + row locks), the table is never locked so readers aren't blocked"""
+        if key:
+            data = self._lock_order(data, key)
+        n = 0
+        with self._instrument("batch") as ev, self._connection(ev) as conn:
+            ev.query = query.as_string(conn) if isinstance(query, sql.Composable) else query
+            with conn.transaction() if atomic else nullcontext(), conn.cursor() as cur:
                 for tuples in self._chunk(data, batch_size):
-                    try:
-                        if table:
-                            cur.execute("BEGIN")
-                            cur.execute(sql.SQL("LOCK TABLE {table}").format(table=sql.Identifier(table)))
+                    with ev.phase("execute"), nullcontext() if atomic else conn.transaction(), self._pipeline(conn):
                         cur.executemany(query, tuples)
-                        conn.commit()
-                        msg = "Success"
-                    except (Exception, psycopg.DatabaseError) as error:
-                        conn.rollback()
-                        cur.close()
-                        raise error
-                conn.commit()
-        return msg
+                    n += len(tuples)
+                    ev.rows_in = n
+                    ev.batches += 1
+        return "Success" if n else ""
         
-    def upsert_df(self, df, table, pkeys=None, batch_size=10000):
-        if pkeys is None:
-            pkeys = self.get_primary_keys(table)
-        if isinstance(pkeys, str):
-            pkeys = [pkeys]
-        cols = self._get_df_db_cols(df, table)
-        df = self._prep_df(df=df[cols], table=table)
+    def _conflict_set(self, table, ex_cols, mode="overwrite"):
+        """SET clause for ON CONFLICT DO UPDATE
+        overwrite: db value replaced by new value
+        except_null: db value replaced by new value unless the new value is null
+        only_null: db value only filled in when it's null"""
+        tbl = table.split(".")[-1]
+        sets = []
+        for c in ex_cols:
+            new, old = sql.Identifier("excluded", c), sql.Identifier(tbl, c)
+            if mode == "overwrite":
+                val = new
+            elif mode == "except_null":
+                val = sql.SQL("COALESCE({}, {})").format(new, old)
+            elif mode == "only_null":
+                val = sql.SQL("COALESCE({}, {})").format(old, new)
+            else:
+                raise ValueError(f"unknown upsert mode {mode}")
+            sets.append(sql.SQL("{} = {}").format(sql.Identifier(c), val))
+        return sql.SQL(", ").join(sets)
+    
+    def _on_conflict(self, table, cols, pkeys, mode="overwrite"):
         ex_cols = [x for x in cols if x not in pkeys]
-
+        if not ex_cols:
+            return sql.SQL("ON CONFLICT ({pkeys}) DO NOTHING").format(pkeys=sql.SQL(", ").join(map(sql.Identifier, pkeys)))
+        return sql.SQL("ON CONFLICT ({pkeys}) DO UPDATE SET {conflict}").format(
+            pkeys=sql.SQL(", ").join(map(sql.Identifier, pkeys)),
+            conflict=self._conflict_set(table, ex_cols, mode))
+    
+    def _upsert_query(self, table, cols, pkeys, mode="overwrite"):
+        """row at a time INSERT ... ON CONFLICT for executemany"""
         params = {'table': sql.Identifier(*table.split(".")),
-                  "pkeys": sql.SQL(", ").join(map(sql.Identifier, pkeys)),
                   "all_cols": sql.SQL(', ').join(map(sql.Identifier, cols)),
                   "vals": sql.SQL(', ').join(sql.Placeholder() * len(cols)),
-                  "conflict": sql.SQL(", ").join([
-                      sql.SQL(" = ").join([
-                      sql.Identifier(c), 
-                      sql.Identifier("excluded",c)
-                  ]) for c in ex_cols])
-                 }
-        
-        query = sql.SQL("""INSERT INTO {table} ({all_cols}) VALUES ({vals}) 
-        ON CONFLICT ({pkeys}) DO UPDATE SET {conflict}""").format(**params)
-
-        return self._batch_execute(query=query, data=df[cols].values, batch_size=batch_size)
+                  "on_conflict": self._on_conflict(table, cols, pkeys, mode)}
+        return sql.SQL("""INSERT INTO {table} ({all_cols}) VALUES ({vals}) 
+        {on_conflict}""").format(**params)
+    
+    def _bulk_upsert_queries(self, table, cols, pkeys, mode="overwrite"):
+        """(create staging table, add ordinal col, COPY into staging, merge into table) statements"""
+        tmp = sql.Identifier(f"_stage_{table.split('.')[-1]}")
+        params = {'table': sql.Identifier(*table.split(".")),
+                  'tmp': tmp,
+                  "all_cols": sql.SQL(', ').join(map(sql.Identifier, cols)),
+                  "pkeys": sql.SQL(", ").join(map(sql.Identifier, pkeys)),
+                  "on_conflict": self._on_conflict(table, cols, pkeys, mode)}
+        return (sql.SQL("""CREATE TEMP TABLE {tmp} ON COMMIT DROP AS 
+                           SELECT {all_cols} FROM {table} WITH NO DATA""").format(**params),
+                sql.SQL("ALTER TABLE {tmp} ADD COLUMN _ord BIGSERIAL").format(tmp=tmp),
+                sql.SQL("COPY {tmp} ({all_cols}) FROM STDIN").format(**params),
+                sql.SQL("""INSERT INTO {table} ({all_cols}) 
+                           SELECT DISTINCT ON ({pkeys}) {all_cols} FROM {tmp} ORDER BY {pkeys}, _ord DESC
+                           {on_conflict}""").format(**params))
+    
+    @staticmethod
+    def _merge_duplicates(rows, key, mode="overwrite"):
+        """rows with one row per key (values at positions key), repeated keys merged the way applying them
+        one after another with mode's ON CONFLICT rule would:
+        overwrite: the last row, except_null: each column's last non-null value, only_null: each column's 
+        first non-null value (the stored value still wins over it). rows is returned as is without repeats"""
+        merged = {}
+        for r in rows:
+            k = tuple(r[i] for i in key)
+            prev = merged.get(k)
+            if prev is None or mode == "overwrite":
+                merged[k] = r
+            elif mode == "except_null":
+                merged[k] = [new if new is not None else old for old, new in zip(prev, r)]
+            elif mode == "only_null":
+                merged[k] = [old if old is not None else new for old, new in zip(prev, r)]
+            else:
+                raise ValueError(f"unknown upsert mode {mode}")
+        if len(merged) == len(rows):
+            return rows
+        return list(merged.values())
     
-    def upsert(self, data, table, pkeys=None, batch_size=10000):
+    def _bulk_upsert(self, table, cols, pkeys, rows, mode="overwrite"):
+        """COPY rows into a session temp table then merge them into table with one
+        INSERT ... SELECT ... ON CONFLICT. _upsert_rows merges duplicate pkeys first, the DISTINCT ON 
+        (last one wins) only guards the single INSERT against hitting one key twice"""
+        create, add_ord, copy_q, merge = self._bulk_upsert_queries(table, cols, pkeys, mode)
+        n = 0
+        with self._instrument("bulk_upsert") as ev, self._connection(ev) as conn:
+            ev.query = merge.as_string(conn)
+            with conn.transaction():
+                with conn.cursor() as cur:
+                    with ev.phase("execute"):
+                        cur.execute(create)
+                        cur.execute(add_ord)
+                    with ev.phase("copy"), cur.copy(copy_q) as copy:
+                        for row in rows:
+                            copy.write_row(tuple(row))
+                            n += 1
+                    with ev.phase("execute"):
+                        cur.execute(merge)
+                    ev.rows_in = n
+                    ev.batches = 1
+        return "Success" if n else ""
+    
+    def _upsert_rows(self, table, cols, pkeys, rows, mode="overwrite", batch_size=10000, method=None, atomic=True):
+        """route rows to the COPY/staging path or executemany
+        method: 'copy', 'executemany' or None to pick copy when len(rows) >= copy_threshold
+        atomic: executemany chunks in one transaction or committed per chunk, the copy path is always one transaction
+        Rows repeating a pkey are merged first (_merge_duplicates), so both paths give the same result for them"""
+        rows = self._merge_duplicates(rows, [cols.index(k) for k in pkeys], mode)
+        if method is None:
+            method = "copy" if len(rows) >= self.copy_threshold else "executemany"
+        if method == "copy":
+            return self._bulk_upsert(table, cols, pkeys, rows, mode=mode)
+        if method != "executemany":
+            raise ValueError(f"unknown upsert method {method}")
+        query = self._upsert_query(table, cols, pkeys, mode=mode)
+        return self._batch_execute(query=query, data=rows, batch_size=batch_size, atomic=atomic,
+                                   key=[cols.index(k) for k in pkeys])
+    
+    def _upsert_args(self, table, pkeys):
         if pkeys is None:
             pkeys = self.get_primary_keys(table)
         if isinstance(pkeys, str):
             pkeys = [pkeys]
+        return pkeys
         
+    def upsert_df(self, df, table, pkeys=None, batch_size=10000, method=None, atomic=True):
+        pkeys = self._upsert_args(table, pkeys)
+        cols = self._get_df_db_cols(df, table)
+        df = self._prep_df(df=df[cols], table=table)
+        return self._upsert_rows(table, cols, pkeys, self._df_rows(df[cols]), batch_size=batch_size, method=method,
+                                 atomic=atomic)
+    
+    def upsert(self, data, table, pkeys=None, batch_size=10000, method=None, atomic=True):
+        pkeys = self._upsert_args(table, pkeys)
         cols = self.get_cols(table)
         values = [[d.get(c, None) for c in cols] for d in data]
-        ex_cols = [x for x in cols if x not in pkeys]
-
-        params = {'table': sql.Identifier(*table.split(".")),
-                  "pkeys": sql.SQL(", ").join(map(sql.Identifier, pkeys)),
-                  "all_cols": sql.SQL(', ').join(map(sql.Identifier, cols)),
-                  "vals": sql.SQL(', ').join(sql.Placeholder() * len(cols)),
-                  "conflict": sql.SQL(", ").join([
-                      sql.SQL(" = ").join([
-                      sql.Identifier(c), 
-                      sql.Identifier("excluded",c)
-                  ]) for c in ex_cols])
-                 }
-        
-        query = sql.SQL("""INSERT INTO {table} ({all_cols}) VALUES ({vals}) 
-        ON CONFLICT ({pkeys}) DO UPDATE SET {conflict}""").format(**params)
-
-        return self._batch_execute(query=query, data=values, batch_size=batch_size)
+        return self._upsert_rows(table, cols, pkeys, values, batch_size=batch_size, method=method, atomic=atomic)
     
-    def upsert_df_except_null(self, df, table, pkeys=None, batch_size=10000):
+    def upsert_df_except_null(self, df, table, pkeys=None, batch_size=10000, method=None, atomic=True):
         """updates database with DF. When db value for column exists, it is overwritten with DF
         if DF value is not null, other wise the DB value stands"""
-        
-        if pkeys is None:
-            pkeys = self.get_primary_keys(table)
-        if isinstance(pkeys, str):
-            pkeys = [pkeys]
+        pkeys = self._upsert_args(table, pkeys)
         cols = self._get_df_db_cols(df, table)
         df = self._prep_df(df=df[cols], table=table)
-        ex_cols = [x for x in cols if x not in pkeys]
+        return self._upsert_rows(table, cols, pkeys, self._df_rows(df[cols]), mode="except_null", 
+                                 batch_size=batch_size, method=method, atomic=atomic)
+    
+    def upsert_df_only_null(self, df, table, pkeys=None, batch_size=10000, method=None, atomic=True):
+        """updates database values that are null with values in DF. If db value for column exists, then do nothing, 
+        else fill with DF value"""
+        pkeys = self._upsert_args(table, pkeys)
+        cols = self._get_df_db_cols(df, table)
+        df = self._prep_df(df=df[cols], table=table)
+        return self._upsert_rows(table, cols, pkeys, self._df_rows(df[cols]), mode="only_null", 
+                                 batch_size=batch_size, method=method, atomic=atomic)
 
-        params = {'table': sql.Identifier(*table.split(".")),
-                  "pkeys": sql.SQL(", ").join(map(sql.Identifier, pkeys)),
-                  "all_cols": sql.SQL(', ').join(map(sql.Identifier, cols)),
-                  "vals": sql.SQL(', ').join(sql.Placeholder() * len(cols)),
-                  "conflict": sql.SQL(", ").join([
-                      sql.SQL(" = ").join([
-                      sql.Identifier(c), 
-                          sql.SQL("COALESCE({})").format(
-                          sql.SQL(", ").join([
-                              sql.Identifier("excluded",c),
-                              sql.Identifier(table,c),
-                          ]))
-                  ]) for c in ex_cols
-                  ])}
+    
+    def write_delta(self, df, table, delete_keys=None, pkeys=None):
+        """apply an edit set in one transaction: upsert the (changed/new) rows in df and 
+        delete rows whose primary key is in delete_keys, so the write is O(changed rows).
+        delete_keys: list of pkey values, tuples of them for composite keys"""
+        pkeys = self._upsert_args(table, pkeys)
+        delete_keys = [k if isinstance(k, (tuple, list)) else (k,) for k in (delete_keys or [])]
+        rows = []
+        if df is not None and len(df):
+            cols = self._get_df_db_cols(df, table)
+            df = self._prep_df(df[cols], table)
+            rows = self._df_rows(df[cols])
+        if not len(rows) and not delete_keys:
+            return ""
+        
+        delete = sql.SQL("DELETE FROM {table} WHERE {cond}").format(
+            table=sql.Identifier(*table.split(".")),
+            cond=sql.SQL(" AND ").join(sql.SQL("{} = %s").format(sql.Identifier(k)) for k in pkeys))
+        with self._instrument("write_delta", f"write_delta {table}") as ev, self._connection(ev) as conn:
+            with conn.transaction():
+                with conn.cursor() as cur, ev.phase("execute"):
+                    if len(rows):
+                        cur.executemany(self._upsert_query(table, cols, pkeys), 
+                                        [tuple(r) for r in self._lock_order(rows, [cols.index(k) for k in pkeys])])
+                    if delete_keys:
+                        cur.executemany(delete, self._lock_order(delete_keys, range(len(pkeys))))
+            ev.rows_in = len(rows) + len(delete_keys)
+        return "Success"
 
-        query = sql.SQL("""
-        INSERT INTO {table} ({all_cols}) VALUES ({vals}) 
-        ON CONFLICT ({pkeys}) DO UPDATE SET {conflict}""").format(**params)
+class AsyncDatabase(Database):
+    """asyncio version of Database on psycopg's AsyncConnection + AsyncConnectionPool, 
+    so independent queries can run concurrently, e.g.
+    
+        db = AsyncDatabase()
+        races = await asyncio.gather(*[db.query(sql, {'tracks': [t]}) for t in tracks])
+    
+    SQL building, dtype cleaning, the metadata cache and instrumentation are shared with Database.
+    Every method that touches a connection is a coroutine (or async context manager/generator) here"""
+    
+    # async pools are bound to the event loop that opened them: (params + pool params, id(loop)) -> (loop, pool).
+    # The loop is kept to check identity, since ids of closed loops get reused (one asyncio.run() after another)
+    _async_pools = {}
+    _async_pools_lock = threading.Lock()
+    
+    @property
+    def pool(self):
+        loop = asyncio.get_running_loop()
+        key = (self._pool_id, id(loop))
+        entry = self._async_pools.get(key)
+        if entry is None or entry[0] is not loop:
+            with self._async_pools_lock:
+                self._drop_closed_loops()
+                entry = self._async_pools.get(key)
+                if entry is None or entry[0] is not loop:
+                    kwargs = self.params.copy()
+                    autocommit = kwargs.pop('autocommit')
+                    pool = AsyncConnectionPool(conninfo=make_conninfo(**kwargs),
+                                               kwargs={'autocommit': autocommit},
+                                               check=AsyncConnectionPool.check_connection,
+                                               name=f"async-{self.params['dbname']}@{self.params['host']}",
+                                               open=False,
+                                               **self.pool_params)
+                    entry = self._async_pools[key] = (loop, pool)
+        return entry[1]
+    
+    @classmethod
+    def _drop_closed_loops(cls):
+        # pools whose loop closed without close_pools() can't be closed any more, 
+        # forget them so they don't pile up, their connections go when they're collected
+        for k in [k for k, (loop, _) in cls._async_pools.items() if loop.is_closed()]:
+            del cls._async_pools[k]
+    
+    @asynccontextmanager
+    async def _connection(self, ev=None):
+        start = time.perf_counter()
+        pool = self.pool
+        if pool.closed:
+            # open() is idempotent once the pool is open
+            await pool.open()
+        async with pool.connection() as conn:
+            if ev is not None:
+                ev.timings['connect'] += (time.perf_counter() - start) * 1000
+            yield conn
+    
+    @asynccontextmanager
+    async def _instrument(self, op, query=None, params=None):
+        ev = QueryEvent(op, query, params)
+        start = time.perf_counter()
+        try:
+            yield ev
+        except Exception as e:
+            ev.error = repr(e)
+            raise
+        finally:
+            ev.total_ms = (time.perf_counter() - start) * 1000
+            if (ev.error is None and ev.explainable and self.instrumentation.explain_slow 
+                    and self.instrumentation.is_slow(ev)):
+                ev.plan = await self._explain(ev.query, ev.params)
+            self.instrumentation.record(ev)
+    
+    async def _explain(self, query, params=None):
+        try:
+            async with self._connection() as conn:
+                async with conn.transaction(force_rollback=True):
+                    cur = await conn.execute(sql.SQL("EXPLAIN (ANALYZE, BUFFERS) ") + sql.SQL(query), params)
+                    rows = await cur.fetchall()
+            return "\n".join(r[0] for r in rows)
+        except Exception as e:
+            return f"explain failed: {e!r}"
+    
+    @asynccontextmanager
+    async def transaction(self):
+        """async with db.transaction() as conn: ..."""
+        async with self._connection() as conn:
+            async with conn.transaction():
+                yield conn
+    
+    @asynccontextmanager
+    async def advisory_lock(self, name):
+        """async with db.advisory_lock(name) as acquired: ..."""
+        async with self._connection() as conn:
+            cur = await conn.execute("SELECT pg_try_advisory_lock(hashtext(%s))", [name])
+            acquired = (await cur.fetchone())[0]
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    await conn.execute("SELECT pg_advisory_unlock(hashtext(%s))", [name])
+    
+    async def notify(self, channel, ids, chunk_size=200, version_seq=None):
+        ids = list(ids)
+        async with self._connection() as conn:
+            for i in range(0, len(ids), chunk_size):
+                chunk = json.dumps(ids[i:i + chunk_size], default=str)
+                if version_seq is None:
+                    await conn.execute("SELECT pg_notify(%s, %s)", [channel, chunk])
+                else:
+                    await conn.execute("""SELECT pg_notify(%s, json_build_object('version', nextval(%s::regclass), 
+                                                                                'ids', %s::json)::text)""",
+                                       [channel, version_seq, chunk])
+    
+    async def listen(self, channel, timeout=None, on_listen=None):
+        """async for channel, payload in db.listen(...), on_listen may be a coroutine function"""
+        async with await psycopg.AsyncConnection.connect(**self.params) as conn:
+            await conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+            if on_listen is not None:
+                r = on_listen()
+                if asyncio.iscoroutine(r):
+                    await r
+            async for n in conn.notifies(timeout=timeout):
+                yield n.channel, n.payload
+    
+    @classmethod
+    async def close_pools(cls):
+        loop = asyncio.get_running_loop()
+        with cls._async_pools_lock:
+            cls._drop_closed_loops()
+            pools = [(k, p) for k, (l, p) in cls._async_pools.items() if l is loop]
+            for k, _ in pools:
+                del cls._async_pools[k]
+        for _, pool in pools:
+            await pool.close()
+    
+    async def query(self, query, params=None, as_df=True, itersize=10000):
+        if as_df:
+            chunks = [c async for c in self.stream(query, params, itersize=itersize, as_="df")]
+            if len(chunks) == 1:
+                return chunks[0]
+            return pd.concat(chunks, ignore_index=True)
+        return await self.execute(query, params, as_dict=True)
+    
+    async def stream(self, query, params=None, itersize=10000, as_="dict"):
+        if as_ not in ("dict", "tuple", "df"):
+            raise ValueError(f"unknown stream format {as_}")
+        row_factory = dict_row if as_ == "dict" else None
         
-        return self._batch_execute(query=query, data=df[cols].values, batch_size=batch_size, table=table)
+        async with self._instrument("stream", params=params) as ev, self._connection(ev) as conn:
+            ev.query = query.as_string(conn) if isinstance(query, sql.Composable) else query
+            async with conn.transaction():
+                async with conn.cursor(name=f"stream_{id(asyncio.current_task())}_{time.monotonic_ns()}",
+                                       row_factory=row_factory) as cur:
+                    cur.itersize = itersize
+                    with ev.phase("execute"):
+                        await cur.execute(query if isinstance(query, sql.Composable) else sql.SQL(query), params)
+                    cols = [d.name for d in cur.description or []]
+                    empty = True
+                    while True:
+                        with ev.phase("fetch"):
+                            rows = await cur.fetchmany(itersize)
+                        if not rows:
+                            break
+                        empty = False
+                        ev.rows_out += len(rows)
+                        ev.batches += 1
+                        yield pd.DataFrame(rows, columns=cols) if as_ == "df" else rows
+                    if empty and as_ == "df":
+                        yield pd.DataFrame(columns=cols)
     
-    def upsert_df_only_null(self, df, table, pkeys=None, batch_size=10000):
-        """updates database values that are null with values in DF. If db value for column exists, then do nothing, 
-        else fill with DF value"""
+    async def _query_dtypes(self, cur, query, table=None):
+        await cur.execute(self._describe_query(query))
+        cols = [(d.name, d.type_code) for d in cur.description]
+        dtypes = await self._get_col_dtypes(table) if table else {}
+        missing = list({oid for c, oid in cols if c not in dtypes})
+        if missing:
+            await cur.execute(self._format_type_sql, (missing,))
+            names = dict(await cur.fetchall())
+            dtypes.update({c: names[oid] for c, oid in cols if c not in dtypes})
+        return {c: dtypes[c] for c, _ in cols}
+    
+    async def query_df(self, query, params=None, table=None):
+        async with self._instrument("copy_out", params=params) as ev, self._connection(ev) as conn:
+            async with psycopg.AsyncClientCursor(conn) as cur:
+                query = self._render(cur, query, params)
+                ev.query = query
+                with ev.phase("describe"):
+                    dtypes = await self._query_dtypes(cur, query, table)
+                buf = io.BytesIO()
+                with ev.phase("copy"):
+                    async with cur.copy(sql.SQL(self._copy_out_sql).format(query=sql.SQL(query))) as copy:
+                        async for data in copy:
+                            buf.write(data)
+            with ev.phase("parse"):
+                df = self._parse_copy(buf, dtypes)
+            ev.rows_out = len(df)
+            return df
+    
+    async def get_table_meta(self, table, refresh=False):
+        meta = None if refresh else self._cached_meta(table)
+        if meta is not None:
+            return meta
+        async with self._instrument("meta", table) as ev, self._connection(ev) as conn:
+            async with conn.cursor() as cur:
+                with ev.phase("execute"):
+                    await cur.execute(self._table_meta_query(table))
+                rows = await cur.fetchall()
+                ev.rows_out = len(rows)
+                return self._store_meta(table, rows)
+    
+    async def _get_col_dtypes(self, table):
+        return dict((await self.get_table_meta(table))['dtypes'])
+    
+    async def get_cols(self, table):
+        return list((await self.get_table_meta(table))['cols'])
+    
+    async def get_primary_keys(self, table):
+        return list((await self.get_table_meta(table))['pkeys'])
+    
+    async def _get_df_db_cols(self, df, table):
+        return self._match_df_cols(df, await self.get_cols(table), table)
+    
+    async def _prep_df(self, df, table):
+        return self._prep_frame(df, await self._get_col_dtypes(table))
+    
+    async def execute(self, query, params=None, as_dict=False, flatten=False):
+        row_factory = dict_row if as_dict else None
+
+        async with self._instrument("execute", params=params) as ev, self._connection(ev) as conn:
+            if isinstance(query, sql.Composable):
+                query = query.as_string(conn)
+            ev.query = query
+            ev.explainable = True
+            fetch = self._execute_check_pattern.search(query) is None
+            async with conn.cursor(row_factory=row_factory) as cur:
+                with ev.phase("execute"):
+                    await cur.execute(sql.SQL(query), params)
+                if fetch and cur.description is not None:
+                    with ev.phase("fetch"):
+                        d = await cur.fetchall()
+                    ev.rows_out = len(d)
+                    if flatten and not as_dict:
+                        out = []
+                        for x in d:
+                            out.extend(x)
+                        return out
+                    return d
+                ev.rows_in = max(cur.rowcount, 0)
+            await conn.commit()
+        for table in self._ddl_pattern.findall(query):
+            self.invalidate_meta(table.replace('"', ''))
+        return "Success"
+    
+    async def insert_df(self, df, table):
+        """only inserts data, fails on load"""
+        cols = await self._get_df_db_cols(df, table)
+        df = await self._prep_df(df[cols], table)
         
+        async with self._instrument("copy", f"COPY {table} ({', '.join(cols)})") as ev, self._connection(ev) as conn:
+            async with conn.cursor() as cur:
+                q = sql.SQL("COPY {table} ({cols}) FROM STDIN").format(**{'table': sql.Identifier(*table.split(".")),
+                                                                 "cols": sql.SQL(', ').join(map(sql.Identifier, cols))})
+                with ev.phase("copy"):
+                    async with cur.copy(q) as copy:
+                        for v in self._df_rows(df[cols]):
+                            await copy.write_row(tuple(v))
+                            ev.rows_in += 1
+    
+    async def _batch_execute(self, query, data, batch_size=10000, atomic=True, key=None):
+        if key:
+            data = self._lock_order(data, key)
+        n = 0
+        async with self._instrument("batch") as ev, self._connection(ev) as conn:
+            ev.query = query.as_string(conn) if isinstance(query, sql.Composable) else query
+            async with conn.transaction() if atomic else nullcontext(), conn.cursor() as cur:
+                for tuples in self._chunk(data, batch_size):
+                    with ev.phase("execute"):
+                        async with nullcontext() if atomic else conn.transaction(), self._pipeline(conn):
+                            await cur.executemany(query, tuples)
+                    n += len(tuples)
+                    ev.rows_in = n
+                    ev.batches += 1
+        return "Success" if n else ""
+    
+    async def _bulk_upsert(self, table, cols, pkeys, rows, mode="overwrite"):
+        create, add_ord, copy_q, merge = self._bulk_upsert_queries(table, cols, pkeys, mode)
+        n = 0
+        async with self._instrument("bulk_upsert") as ev, self._connection(ev) as conn:
+            ev.query = merge.as_string(conn)
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    with ev.phase("execute"):
+                        await cur.execute(create)
+                        await cur.execute(add_ord)
+                    with ev.phase("copy"):
+                        async with cur.copy(copy_q) as copy:
+                            for row in rows:
+                                await copy.write_row(tuple(row))
+                                n += 1
+                    with ev.phase("execute"):
+                        await cur.execute(merge)
+                    ev.rows_in = n
+                    ev.batches = 1
+        return "Success" if n else ""
+    
+    async def _upsert_rows(self, table, cols, pkeys, rows, mode="overwrite", batch_size=10000, method=None, atomic=True):
+        rows = self._merge_duplicates(rows, [cols.index(k) for k in pkeys], mode)
+        if method is None:
+            method = "copy" if len(rows) >= self.copy_threshold else "executemany"
+        if method == "copy":
+            return await self._bulk_upsert(table, cols, pkeys, rows, mode=mode)
+        if method != "executemany":
+            raise ValueError(f"unknown upsert method {method}")
+        query = self._upsert_query(table, cols, pkeys, mode=mode)
+        return await self._batch_execute(query=query, data=rows, batch_size=batch_size, atomic=atomic,
+                                         key=[cols.index(k) for k in pkeys])
+    
+    async def _upsert_args(self, table, pkeys):
         if pkeys is None:
-            pkeys = self.get_primary_keys(table)
+            pkeys = await self.get_primary_keys(table)
         if isinstance(pkeys, str):
             pkeys = [pkeys]
-        cols = self._get_df_db_cols(df, table)
-        df = self._prep_df(df=df[cols], table=table)
-        ex_cols = [x for x in cols if x not in pkeys]
-
-        params = {'table': sql.Identifier(*table.split(".")),
-                  "pkeys": sql.SQL(", ").join(map(sql.Identifier, pkeys)),
-                  "all_cols": sql.SQL(', ').join(map(sql.Identifier, cols)),
-                  "vals": sql.SQL(', ').join(sql.Placeholder() * len(cols)),
-                  "conflict": sql.SQL(", ").join([
-                      sql.SQL(" = ").join([
-                      sql.Identifier(c), 
-                          sql.SQL("COALESCE({})").format(
-                          sql.SQL(", ").join([
-                              sql.Identifier(table,c),
-                              sql.Identifier("excluded",c),
-                          ]))
-                  ]) for c in ex_cols
-                  ])}
-
-        query = sql.SQL("""INSERT INTO {table} ({all_cols}) VALUES ({vals}) 
-        ON CONFLICT ({pkeys}) DO UPDATE SET {conflict}""").format(**params)
+        return pkeys
+    
+    async def _upsert_df(self, df, table, pkeys, mode, batch_size, method, atomic=True):
+        pkeys = await self._upsert_args(table, pkeys)
+        cols = await self._get_df_db_cols(df, table)
+        df = await self._prep_df(df[cols], table)
+        return await self._upsert_rows(table, cols, pkeys, self._df_rows(df[cols]), mode=mode,
+                                       batch_size=batch_size, method=method, atomic=atomic)
+    
+    async def upsert_df(self, df, table, pkeys=None, batch_size=10000, method=None, atomic=True):
+        return await self._upsert_df(df, table, pkeys, "overwrite", batch_size, method, atomic)
+    
+    async def upsert(self, data, table, pkeys=None, batch_size=10000, method=None, atomic=True):
+        pkeys = await self._upsert_args(table, pkeys)
+        cols = await self.get_cols(table)
+        values = [[d.get(c, None) for c in cols] for d in data]
+        return await self._upsert_rows(table, cols, pkeys, values, batch_size=batch_size, method=method,
+                                       atomic=atomic)
+    
+    async def upsert_df_except_null(self, df, table, pkeys=None, batch_size=10000, method=None, atomic=True):
+        return await self._upsert_df(df, table, pkeys, "except_null", batch_size, method, atomic)
+    
+    async def upsert_df_only_null(self, df, table, pkeys=None, batch_size=10000, method=None, atomic=True):
+        return await self._upsert_df(df, table, pkeys, "only_null", batch_size, method, atomic)
+    
+    async def write_delta(self, df, table, delete_keys=None, pkeys=None):
+        pkeys = await self._upsert_args(table, pkeys)
+        delete_keys = [k if isinstance(k, (tuple, list)) else (k,) for k in (delete_keys or [])]
+        rows = []
+        if df is not None and len(df):
+            cols = await self._get_df_db_cols(df, table)
+            df = await self._prep_df(df[cols], table)
+            rows = self._df_rows(df[cols])
+        if not len(rows) and not delete_keys:
+            return ""
         
-        return self._batch_execute(query=query, data=df[cols].values, batch_size=batch_size)
-        
\ No newline at end of file
+        delete = sql.SQL("DELETE FROM {table} WHERE {cond}").format(
+            table=sql.Identifier(*table.split(".")),
+            cond=sql.SQL(" AND ").join(sql.SQL("{} = %s").format(sql.Identifier(k)) for k in pkeys))
+        async with self._instrument("write_delta", f"write_delta {table}") as ev, self._connection(ev) as conn:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    with ev.phase("execute"):
+                        if len(rows):
+                            await cur.executemany(self._upsert_query(table, cols, pkeys), 
+                                                  [tuple(r) for r in self._lock_order(rows, [cols.index(k) for k in pkeys])])
+                        if delete_keys:
+                            await cur.executemany(delete, self._lock_order(delete_keys, range(len(pkeys))))
+            ev.rows_in = len(rows) + len(delete_keys)
+        return "Success"
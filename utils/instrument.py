@@ -0,0 +1,151 @@
+"""timing / row counts for Database calls, a slow query log and per query-fingerprint percentiles
+
+every instrumented Database call builds a QueryEvent and hands it to Instrumentation.record, which
+aggregates it and passes it to the registered hooks (callables taking the event), e.g.
+
+    from utils.instrument import instrumentation
+    instrumentation.add_hook(lambda ev: statsd.timing(ev.fingerprint, ev.total_ms))
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger("utils.database")
+
+_STRING_PAT = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_PAT = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE_PAT = re.compile(r"\s+")
+_IN_LIST_PAT = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+
+
+def fingerprint(query):
+    """normalise a query so calls differing only in literals/whitespace aggregate together"""
+    q = _STRING_PAT.sub("?", query)
+    q = _NUMBER_PAT.sub("?", q)
+    q = _IN_LIST_PAT.sub("(?)", q)
+    return _SPACE_PAT.sub(" ", q).strip().lower()
+
+
+class QueryEvent:
+    """one Database call: op ('execute', 'stream', 'copy', 'batch', 'bulk_upsert', ...), 
+    query text, per phase timings in ms (connect/execute/fetch/copy), rows in/out, batches"""
+    
+    def __init__(self, op, query=None, params=None):
+        self.op = op
+        self.query = query
+        self.params = params
+        self.timings = defaultdict(float)
+        self.rows_in = 0
+        self.rows_out = 0
+        self.batches = 0
+        self.total_ms = None
+        self.error = None
+        self.plan = None
+        self.slow = False
+        # plain statements from execute can be re-run under EXPLAIN ANALYZE when slow
+        self.explainable = False
+    
+    @property
+    def fingerprint(self):
+        return f"{self.op}: {fingerprint(self.query or '')}"
+    
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += (time.perf_counter() - start) * 1000
+    
+    def as_dict(self):
+        return {'op': self.op, 'fingerprint': self.fingerprint, 'total_ms': self.total_ms, 
+                'timings_ms': dict(self.timings), 'rows_in': self.rows_in, 'rows_out': self.rows_out, 
+                'batches': self.batches, 'error': self.error, 'slow': self.slow, 'plan': self.plan}
+
+
+class Instrumentation:
+    """aggregates QueryEvents per fingerprint (last `window` durations kept for percentiles),
+    logs slow ones and fans events out to hooks"""
+    
+    def __init__(self, slow_query_ms=None, explain_slow=None, window=1000):
+        self.slow_query_ms = float(slow_query_ms if slow_query_ms is not None else os.getenv("DB_SLOW_QUERY_MS", 500))
+        explain = explain_slow if explain_slow is not None else os.getenv("DB_EXPLAIN_SLOW", "0")
+        self.explain_slow = str(explain).lower() in ("1", "true", "yes")
+        self.window = window
+        self.hooks = []
+        self._stats = {}
+        self._lock = threading.Lock()
+    
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+    
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+    
+    def is_slow(self, ev):
+        return ev.total_ms is not None and ev.total_ms >= self.slow_query_ms
+    
+    def record(self, ev):
+        ev.slow = self.is_slow(ev)
+        key = ev.fingerprint
+        with self._lock:
+            s = self._stats.get(key)
+            if s is None:
+                s = self._stats[key] = {'calls': 0, 'errors': 0, 'slow': 0, 'rows_in': 0, 'rows_out': 0, 'batches': 0,
+                                        'total_ms': 0.0, 'phase_ms': defaultdict(float), 
+                                        'durations': deque(maxlen=self.window)}
+            s['calls'] += 1
+            s['errors'] += ev.error is not None
+            s['slow'] += ev.slow
+            s['rows_in'] += ev.rows_in
+            s['rows_out'] += ev.rows_out
+            s['batches'] += ev.batches
+            s['total_ms'] += ev.total_ms
+            for k, v in ev.timings.items():
+                s['phase_ms'][k] += v
+            s['durations'].append(ev.total_ms)
+        
+        if ev.slow:
+            logger.warning("slow query %.1fms %s", ev.total_ms, ev.fingerprint, extra={'db_event': ev.as_dict()})
+        else:
+            logger.debug("query %.1fms %s", ev.total_ms, ev.fingerprint, extra={'db_event': ev.as_dict()})
+        for hook in list(self.hooks):
+            try:
+                hook(ev)
+            except Exception:
+                logger.exception("instrumentation hook failed")
+    
+    @staticmethod
+    def _percentile(sorted_vals, p):
+        if not sorted_vals:
+            return None
+        i = min(len(sorted_vals) - 1, max(0, int(round(p / 100 * (len(sorted_vals) - 1)))))
+        return sorted_vals[i]
+    
+    def stats(self):
+        """{fingerprint: calls, errors, slow, rows, mean/p50/p95/p99 ms over the window, summed phase ms}"""
+        with self._lock:
+            snapshot = {k: (dict(v), list(v['durations'])) for k, v in self._stats.items()}
+        out = {}
+        for key, (s, durations) in snapshot.items():
+            d = sorted(durations)
+            out[key] = {'calls': s['calls'], 'errors': s['errors'], 'slow': s['slow'],
+                        'rows_in': s['rows_in'], 'rows_out': s['rows_out'], 'batches': s['batches'],
+                        'mean_ms': s['total_ms'] / s['calls'],
+                        'p50_ms': self._percentile(d, 50), 'p95_ms': self._percentile(d, 95), 
+                        'p99_ms': self._percentile(d, 99),
+                        'phase_ms': dict(s['phase_ms'])}
+        return out
+    
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+# process wide default shared by every Database
+instrumentation = Instrumentation()
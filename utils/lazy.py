@@ -0,0 +1,43 @@
+"""deferred imports for heavy modules, so importing the app (and booting a worker) doesn't pay for
+pandas/numpy/plotly/pyarrow until a request actually uses them
+
+    pd = lazy_import("pandas")    # stand-in module now, pandas is imported on the first pd.<attr>
+"""
+import sys
+import types
+import threading
+import importlib
+import importlib.util
+
+# one lock for every first load: gthread workers can hit pd.<attr> from several request threads at once
+_lock = threading.RLock()
+
+
+class _LazyModule(types.ModuleType):
+    """stand-in for a module, the first missing attribute lookup does a normal import under _lock
+    (so concurrent first uses wait for one complete import) and copies the module's namespace in,
+    later lookups are plain attribute hits"""
+
+    def __getattr__(self, attr):
+        with _lock:
+            module = self.__dict__.get('_lazy_module')
+            if module is None:
+                module = importlib.import_module(self.__name__)
+                self.__dict__.update(module.__dict__)
+                self.__dict__['_lazy_module'] = module
+        return getattr(module, attr)
+
+
+def lazy_import(name, optional=False):
+    """module that's imported on first attribute access.
+    optional: None instead of ImportError when it isn't installed
+
+    Only the top level package is looked up here, find_spec("plotly.express") would import plotly
+    to find its submodule, so a missing submodule raises on first use instead"""
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name.partition(".")[0]) is None:
+        if optional:
+            return None
+        raise ImportError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
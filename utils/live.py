@@ -0,0 +1,146 @@
+"""in-process live race board fed by postgres LISTEN/NOTIFY
+
+the ETL NOTIFYs RACES_CHANNEL (notify_races) with the race_ids it wrote and a version from the
+tvg.race_board_version sequence, one listener thread per process re-reads just those rows. 
+Dashboards poll with the version they have, which is answered from memory, so db load doesn't grow 
+with the number of open boards. Versions come from the database, not a per-process counter, so any 
+gunicorn worker can answer any client. The ETL is the only writer (it runs under an advisory lock), 
+so notifies arrive in version order"""
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from utils.database import Database
+
+logger = logging.getLogger(__name__)
+
+RACES_CHANNEL = "races_changed"
+VERSION_SEQ = "tvg.race_board_version"
+BOARD_VERSION_SQL = "SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version FROM tvg.race_board_version"
+
+OPEN_RACES_SQL = """SELECT r.race_id, r.track_id, r.race_date, r.post_time, r.race_number, 
+                           r.distance, r.num_runners, r.surface, r.race_class
+                    FROM tvg.races r JOIN tvg.race_schedule s USING (race_id)
+                    WHERE s.removed_at IS NULL"""
+
+
+def notify_races(db, race_ids):
+    """tell every process's board that race_ids changed"""
+    db.notify(RACES_CHANNEL, race_ids, version_seq=VERSION_SEQ)
+
+
+class RaceBoard:
+    """{race_id: row} of the races still on the open schedule, the board version (tvg.race_board_version)
+    they're current as of and a bounded log of which race_ids changed at each version"""
+    
+    def __init__(self, db=None, max_log=1000, start_timeout=10):
+        self.db = db or Database()
+        self.rows = {}
+        self.version = 0
+        self._log = deque(maxlen=max_log)  # (version, race_ids)
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._loaded = threading.Event()
+        self.start_timeout = start_timeout
+    
+    def start(self):
+        """start the listener thread, once per process, and wait (up to start_timeout) for the first load"""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    thread = threading.Thread(target=self._listen, name="race-board", daemon=True)
+                    thread.start()
+                    self._thread = thread
+        if not self._loaded.wait(self.start_timeout):
+            logger.warning("RaceBoard: not loaded after %ss, serving an empty board", self.start_timeout)
+        return self
+    
+    def reload(self):
+        # version first, so the rows are at least as new as it
+        version = self.db.query(BOARD_VERSION_SQL, as_df=False)[0]['version']
+        rows = {r['race_id']: self._jsonable(r) for r in self.db.query(OPEN_RACES_SQL, as_df=False)}
+        with self._lock:
+            self.rows = rows
+            self.version = max(self.version, version)
+            # clients older than this get a full snapshot
+            self._log.clear()
+            self._log.append((self.version, None))
+    
+    def apply(self, version, race_ids):
+        """re-read race_ids changed at version, races no longer open are dropped from the board"""
+        race_ids = list(race_ids)
+        data = self.db.query(OPEN_RACES_SQL + " AND r.race_id = ANY(%(race_ids)s)", {'race_ids': race_ids}, as_df=False)
+        fresh = {r['race_id']: self._jsonable(r) for r in data}
+        with self._lock:
+            for race_id in race_ids:
+                if race_id in fresh:
+                    self.rows[race_id] = fresh[race_id]
+                else:
+                    self.rows.pop(race_id, None)
+            if version > self.version:
+                self.version = version
+                self._log.append((version, set(race_ids)))
+    
+    def changes_since(self, version):
+        """(current version, {race_id: row or None (removed)} or None if the client needs a full snapshot)"""
+        with self._lock:
+            if version == self.version:
+                return self.version, {}
+            if version is not None and version > self.version:
+                # the client was last served by a worker that's ahead of this one, nothing newer here
+                return version, {}
+            if version is None or not self._log or version < self._log[0][0]:
+                return self.version, None
+            ids = set()
+            for v, race_ids in self._log:
+                if v > version:
+                    if race_ids is None:
+                        return self.version, None
+                    ids |= race_ids
+            return self.version, {race_id: self.rows.get(race_id) for race_id in ids}
+    
+    def snapshot(self):
+        with self._lock:
+            return self.version, dict(self.rows)
+    
+    @staticmethod
+    def _jsonable(row):
+        # post_time is stored as UTC, the Z lets the browser count down in local time
+        row = dict(row)
+        if row.get('post_time') is not None:
+            row['post_time'] = row['post_time'].isoformat() + "Z"
+        if row.get('race_date') is not None:
+            row['race_date'] = row['race_date'].isoformat()
+        return row
+    
+    def _on_listen(self):
+        # (re)load only once LISTEN is active, a notify sent in between is then queued rather than lost.
+        # after a reconnect this also picks up whatever was missed while disconnected
+        self.reload()
+        self._loaded.set()
+    
+    def _listen(self):
+        while True:
+            try:
+                for _, payload in self.db.listen(RACES_CHANNEL, on_listen=self._on_listen):
+                    payload = json.loads(payload)
+                    self.apply(payload['version'], payload['ids'])
+            except Exception:
+                logger.exception("RaceBoard: listener or reload failed, reconnecting in 5s")
+                time.sleep(5)
+
+
+_board = None
+_board_lock = threading.Lock()
+
+def get_board():
+    """process wide board, started on first use"""
+    global _board
+    if _board is None:
+        with _board_lock:
+            if _board is None:
+                _board = RaceBoard()
+    return _board.start()
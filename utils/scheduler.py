@@ -0,0 +1,128 @@
+import time
+import random
+import datetime
+import threading
+import traceback
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
+
+from utils.database import Database
+
+
+class JobRunner:
+    """in-process job runner on APScheduler
+    - jobs run on their own thread pool so they never hold a Dash/Flask request thread
+    - coalesce + max_instances=1: missed runs collapse into one and a job never overlaps itself
+    - jitter spreads runs so multiple workers don't hit TVG/postgres at the same instant
+    - lock=True wraps each run in a postgres advisory lock, so with several gunicorn workers
+      (or hosts) each running a JobRunner only one of them actually runs a given job
+    - dynamic jobs pick their next delay after every run, e.g. tighter polling as post time nears
+    - metrics: per job runs / failures / skipped (lock held elsewhere) / durations / last error
+    
+    jobs are expected to be I/O bound (http + db) which is why a thread pool is used"""
+    
+    def __init__(self, db=None, max_workers=4, misfire_grace_time=60, timezone="UTC"):
+        self.db = db or Database()
+        self.scheduler = BackgroundScheduler(
+            executors={'default': ThreadPoolExecutor(max_workers)},
+            job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': misfire_grace_time},
+            timezone=timezone)
+        self._dynamic = {}
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+    
+    def _metric(self, name):
+        return self._metrics.setdefault(name, {'runs': 0, 'failures': 0, 'skipped': 0, 'running': False,
+                                               'last_start': None, 'last_duration': None, 'total_duration': 0.0,
+                                               'max_duration': 0.0, 'last_error': None, 'next_delay': None})
+    
+    def _run(self, name, func, lock, args, kwargs):
+        with self._metrics_lock:
+            self._metric(name)
+        if lock:
+            with self.db.advisory_lock(f"job:{name}") as acquired:
+                if not acquired:
+                    with self._metrics_lock:
+                        self._metric(name)['skipped'] += 1
+                    return
+                return self._timed(name, func, args, kwargs)
+        return self._timed(name, func, args, kwargs)
+    
+    def _timed(self, name, func, args, kwargs):
+        start = time.perf_counter()
+        with self._metrics_lock:
+            m = self._metric(name)
+            m['running'] = True
+            m['last_start'] = datetime.datetime.utcnow().isoformat()
+        error = None
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            error = "".join(traceback.format_exception_only(type(e), e)).strip()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._metrics_lock:
+                m['running'] = False
+                m['runs'] += 1
+                m['last_duration'] = elapsed
+                m['total_duration'] += elapsed
+                m['max_duration'] = max(m['max_duration'], elapsed)
+                if error:
+                    m['failures'] += 1
+                    m['last_error'] = error
+    
+    def add_job(self, func, trigger, name=None, lock=True, args=(), kwargs=None, **trigger_args):
+        """schedule func on a fixed APScheduler trigger ('interval', 'cron', ...), 
+        trigger_args are passed through, e.g. seconds=60, jitter=5"""
+        name = name or func.__name__
+        self.scheduler.add_job(self._run, trigger, args=[name, func, lock, args, kwargs or {}], 
+                               id=name, name=name, replace_existing=True, **trigger_args)
+        return name
+    
+    def add_dynamic_job(self, func, cadence, name=None, lock=True, jitter=0, default_delay=300, 
+                        args=(), kwargs=None, run_now=True):
+        """run func, then wait cadence() seconds (plus up to jitter seconds) before the next run.
+        If cadence() fails default_delay is used"""
+        name = name or func.__name__
+        self._dynamic[name] = dict(func=func, cadence=cadence, lock=lock, jitter=jitter, 
+                                   default_delay=default_delay, args=args, kwargs=kwargs or {})
+        self._schedule_next(name, 0 if run_now else None)
+        return name
+    
+    def _schedule_next(self, name, delay=None):
+        job = self._dynamic[name]
+        if delay is None:
+            try:
+                delay = job['cadence']()
+            except Exception:
+                delay = job['default_delay']
+            delay += random.uniform(0, job['jitter'])
+        with self._metrics_lock:
+            self._metric(name)['next_delay'] = delay
+        run_date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=delay)
+        self.scheduler.add_job(self._run_dynamic, 'date', run_date=run_date, args=[name],
+                               id=name, name=name, replace_existing=True)
+    
+    def _run_dynamic(self, name):
+        job = self._dynamic[name]
+        try:
+            self._run(name, job['func'], job['lock'], job['args'], job['kwargs'])
+        finally:
+            if self.scheduler.running:
+                self._schedule_next(name)
+    
+    def metrics(self):
+        """{job name: run metrics}"""
+        with self._metrics_lock:
+            out = {k: dict(v) for k, v in self._metrics.items()}
+        for v in out.values():
+            v['avg_duration'] = v['total_duration'] / v['runs'] if v['runs'] else None
+        return out
+    
+    def start(self):
+        self.scheduler.start()
+    
+    def shutdown(self, wait=False):
+        self.scheduler.shutdown(wait=wait)
@@ -0,0 +1,114 @@
+"""append, query and bound the race snapshot history in sql/snapshots.sql"""
+import os
+import datetime
+
+from utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+# rows older than FULL_HOURS are thinned to one per race per DOWNSAMPLE_MINUTES (plus every change in 
+# DOWNSAMPLE_COLS), dropped after KEEP_DAYS
+KEEP_DAYS = int(os.getenv("SNAPSHOT_KEEP_DAYS", 90))
+FULL_HOURS = int(os.getenv("SNAPSHOT_FULL_HOURS", 24))
+DOWNSAMPLE_MINUTES = int(os.getenv("SNAPSHOT_DOWNSAMPLE_MINUTES", 15))
+
+SNAPSHOT_COLS = ['captured_at', 'race_id', 'track_id', 'race_date', 'post_time', 'mtp', 'num_runners']
+# mtp counts down every poll, comparing it would keep every row
+DOWNSAMPLE_COLS = ("post_time", "num_runners")
+
+RACE_STATE_AT = """SELECT * FROM tvg.race_snapshots 
+                   WHERE race_id = %(race_id)s AND captured_at <= %(at)s
+                   ORDER BY captured_at DESC LIMIT 1"""
+
+# rows where any of the compared columns differ from the race's previous snapshot, first snapshots included
+TRACK_CHANGES = """SELECT * FROM (
+                       SELECT *, row_number() OVER w = 1 OR {changed} AS _changed
+                       FROM tvg.race_snapshots
+                       WHERE {where}
+                       WINDOW w AS (PARTITION BY race_id ORDER BY captured_at)) s
+                   WHERE _changed ORDER BY captured_at, race_id"""
+
+# for rows in [start, cutoff) keep the first snapshot per race per bucket and every row where {changed}.
+# Each race's last row before start (an index lookup) is added to the window, never deleted, 
+# so the first row in range is compared with it rather than counted as a change
+DOWNSAMPLE = """WITH r AS (
+                    SELECT ctid, * FROM tvg.race_snapshots
+                    WHERE captured_at >= %(start)s AND captured_at < %(cutoff)s),
+                prev AS (
+                    SELECT p.* FROM (SELECT DISTINCT race_id FROM r) ids CROSS JOIN LATERAL (
+                        SELECT NULL::tid AS ctid, * FROM tvg.race_snapshots s
+                        WHERE s.race_id = ids.race_id AND s.captured_at < %(start)s
+                        ORDER BY s.captured_at DESC LIMIT 1) p),
+                x AS (
+                    SELECT ctid, {changed} AS changed, row_number() OVER (
+                               PARTITION BY race_id, floor(extract(epoch FROM captured_at) / %(seconds)s)
+                               ORDER BY captured_at) AS n
+                    FROM (SELECT * FROM r UNION ALL SELECT * FROM prev) a
+                    WINDOW w AS (PARTITION BY race_id ORDER BY captured_at))
+                DELETE FROM tvg.race_snapshots s USING x
+                WHERE s.ctid = x.ctid AND x.n > 1 AND NOT x.changed"""
+
+PRUNE = "DELETE FROM tvg.race_snapshots WHERE captured_at < %(cutoff)s"
+
+
+def append_snapshots(db, rows):
+    """COPY a batch of snapshot dicts (SNAPSHOT_COLS) into tvg.race_snapshots"""
+    if rows:
+        db.insert_df(pd.DataFrame(rows, columns=SNAPSHOT_COLS), "tvg.race_snapshots")
+
+
+def race_state_at(db, race_id, at):
+    """latest snapshot of race_id captured at or before at (UTC), None if there isn't one"""
+    rows = db.query(RACE_STATE_AT, {'race_id': race_id, 'at': at}, as_df=False)
+    return rows[0] if rows else None
+
+
+def _captured_where(where, params, start=None, end=None):
+    where = list(where)
+    if start:
+        where.append("captured_at >= %(start)s")
+        params['start'] = start
+    if end:
+        where.append("captured_at < %(end)s")
+        params['end'] = end
+    return " AND ".join(where), params
+
+
+def race_history(db, race_id, start=None, end=None):
+    where, params = _captured_where(["race_id = %(race_id)s"], {'race_id': race_id}, start, end)
+    return db.query(f"SELECT * FROM tvg.race_snapshots WHERE {where} ORDER BY captured_at", params)
+
+
+def _changed(cols):
+    """sql that's true where one of cols differs from the previous row in window w"""
+    return " OR ".join(f"{c} IS DISTINCT FROM lag({c}) OVER w" for c in cols) or "FALSE"
+
+
+def track_changes(db, track_id, start, end=None, cols=("post_time", "num_runners")):
+    """snapshots for track_id captured in [start, end) where one of cols changed, e.g. post time drift 
+    and scratches today. mtp ticks down every poll so it isn't compared by default"""
+    where, params = _captured_where(["track_id = %(track_id)s"], {'track_id': track_id}, start, end)
+    df = db.query(TRACK_CHANGES.format(changed=_changed(cols), where=where), params)
+    return df.drop(columns="_changed", errors="ignore")
+
+
+def downsample_snapshots(db, full_hours=FULL_HOURS, minutes=DOWNSAMPLE_MINUTES, lookback_hours=48, 
+                         cols=DOWNSAMPLE_COLS):
+    """thin snapshots older than full_hours to one per race per `minutes`, keeping every snapshot where 
+    one of cols changed so track_changes still sees post time drift and scratches. Only the last 
+    lookback_hours before the cutoff are scanned, earlier rows were thinned by previous runs"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=full_hours)
+    return db.execute(DOWNSAMPLE.format(changed=_changed(cols)), 
+                      {'seconds': minutes * 60, 'cutoff': cutoff, 
+                       'start': cutoff - datetime.timedelta(hours=lookback_hours)})
+
+
+def prune_snapshots(db, keep_days=KEEP_DAYS):
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=keep_days)
+    return db.execute(PRUNE, {'cutoff': cutoff})
+
+
+def maintain_snapshots(db):
+    """retention job: downsample then prune, run hourly by the app's JobRunner"""
+    downsample_snapshots(db)
+    prune_snapshots(db)
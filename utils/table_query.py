@@ -0,0 +1,101 @@
+"""translate dash DataTable custom paging/sorting/filtering props into parameterised SQL, and diff edited table data"""
+from psycopg import sql
+
+# (DataTable filter operator(s), SQL template), checked in order so 'ge'/'>=' wins over '>'
+FILTER_OPERATORS = [
+    (('ge ', '>='), "{col} >= {val}"),
+    (('le ', '<='), "{col} <= {val}"),
+    (('lt ', '<'), "{col} < {val}"),
+    (('gt ', '>'), "{col} > {val}"),
+    (('ne ', '!='), "{col} != {val}"),
+    (('eq ', '='), "{col} = {val}"),
+    (('contains ',), "{col}::text ILIKE {val}"),
+    (('datestartswith ',), "{col}::text LIKE {val}"),
+]
+
+
+def split_filter_part(filter_part):
+    """'{track_id} contains bel' -> ('track_id', 'contains ', 'bel'). The operator is matched as the token
+    right after the {column}, so operator-like text in the value ('contains Lone Star') isn't split on"""
+    start, end = filter_part.find('{'), filter_part.find('}')
+    if start == -1 or end < start:
+        return None, None, None
+    name = filter_part[start + 1: end]
+    rest = filter_part[end + 1:].lstrip()
+    for operators, template in FILTER_OPERATORS:
+        for operator in operators:
+            if rest.startswith(operator):
+                value_part = rest[len(operator):].strip()
+                v0 = value_part[:1]
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1:-1].replace('\\' + v0, v0)
+                else:
+                    value = value_part
+                return name, operators[0], value
+    return None, None, None
+
+
+def build_filters(filter_query, cols):
+    """DataTable filter_query -> (list of sql conditions, params). Unknown columns are ignored"""
+    conditions, params = [], {}
+    for i, part in enumerate((filter_query or "").split(' && ')):
+        name, operator, value = split_filter_part(part)
+        if name not in cols or value in (None, ""):
+            continue
+        key = f"_f{i}"
+        template = dict((ops[0], t) for ops, t in FILTER_OPERATORS)[operator]
+        if operator == 'contains ':
+            value = f"%{value}%"
+        elif operator == 'datestartswith ':
+            value = f"{value}%"
+        # values go in as untyped strings so postgres casts them to the column's type
+        conditions.append(sql.SQL(template).format(col=sql.Identifier(name), val=sql.Placeholder(key)))
+        params[key] = str(value)
+    return conditions, params
+
+
+def build_page_query(table, cols, page_current=0, page_size=50, sort_by=None, filter_query=None,
+                     where=None, params=None, default_sort=None):
+    """(page query, count query, params) for one page of table
+    
+    where: extra sql conditions (strings or sql.Composable) ANDed with the DataTable filters, e.g.
+           "track_id=ANY(%(tracks)s)", with their values in params
+    sort_by: DataTable sort_by [{'column_id': 'race_date', 'direction': 'desc'}, ...]
+    default_sort: same format, used after sort_by so paging order is stable
+    """
+    params = dict(params or {})
+    conditions = [sql.SQL(w) if isinstance(w, str) else w for w in (where or [])]
+    filters, filter_params = build_filters(filter_query, cols)
+    conditions += filters
+    params.update(filter_params)
+    
+    where_sql = sql.SQL("")
+    if conditions:
+        where_sql = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+    
+    order, seen = [], set()
+    for s in (sort_by or []) + (default_sort or []):
+        c = s['column_id']
+        if c not in cols or c in seen:
+            continue
+        seen.add(c)
+        direction = sql.SQL("DESC NULLS LAST" if s.get('direction') == 'desc' else "ASC NULLS LAST")
+        order.append(sql.SQL("{} {}").format(sql.Identifier(c), direction))
+    order_sql = sql.SQL(" ORDER BY ") + sql.SQL(", ").join(order) if order else sql.SQL("")
+    
+    params['_limit'] = int(page_size)
+    params['_offset'] = int(page_current or 0) * int(page_size)
+    tbl = sql.Identifier(*table.split("."))
+    query = sql.SQL("SELECT {cols} FROM {table}{where}{order} LIMIT %(_limit)s OFFSET %(_offset)s").format(
+        cols=sql.SQL(", ").join(map(sql.Identifier, cols)), table=tbl, where=where_sql, order=order_sql)
+    count = sql.SQL("SELECT count(*) AS n FROM {table}{where}").format(table=tbl, where=where_sql)
+    return query, count, params
+
+
+def diff_rows(previous, current, pkey):
+    """(changed or new rows, deleted rows) between two versions of DataTable data"""
+    prev = {r.get(pkey): r for r in previous or []}
+    cur = {r.get(pkey): r for r in current or []}
+    changed = [r for k, r in cur.items() if prev.get(k) != r]
+    deleted = [r for k, r in prev.items() if k not in cur]
+    return changed, deleted
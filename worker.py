@@ -0,0 +1,18 @@
+"""runs the scheduled ETL jobs outside the web workers
+
+    python worker.py
+
+jobs take postgres advisory locks so a second worker process (another host) is a hot standby, not a double run"""
+import signal
+import threading
+
+from app import start_scheduler
+
+
+if __name__ == '__main__':
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    runner = start_scheduler()
+    stop.wait()
+    runner.shutdown()
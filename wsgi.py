@@ -0,0 +1,12 @@
+"""production entry point, gunicorn -c gunicorn.conf.py (which serves wsgi:server)
+
+web workers only serve requests, run the ETL jobs once per deployment with `python worker.py`.
+page data is cached across workers in $CACHE_DIR (see utils.cache.SharedCache)"""
+import os
+
+os.environ.setdefault("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+from app import create_app
+
+app = create_app(scheduler=False)
+server = app.server